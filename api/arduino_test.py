@@ -1,40 +1,69 @@
-import serial
-import threading
+import asyncio
+import os
+import sys
+import serial_asyncio_fast
 
 # Update this to match your port
 SERIAL_PORT = '/dev/ttyACM0'  # Windows: 'COM3', Linux: '/dev/ttyUSB0' or '/dev/ttyACM0'
 BAUD_RATE = 9600
 
-def read_from_serial(ser):
+async def read_from_serial(reader):
     while True:
-        if ser.in_waiting > 0:
-            line = ser.readline().decode('utf-8', errors='ignore').strip()
-            if line:
-                print(f"[Arduino] {line}")
+        line = await reader.readuntil(b'\n')
+        line = line.decode('utf-8', errors='ignore').strip()
+        if line:
+            print(f"[Arduino] {line}")
 
-def main():
+async def write_to_serial(writer):
+    loop = asyncio.get_running_loop()
+    lines = asyncio.Queue()
+    buf = bytearray()
+    stdin_fd = sys.stdin.fileno()
+
+    def on_stdin():
+        data = os.read(stdin_fd, 4096)
+        if not data:  # EOF (Ctrl+D)
+            lines.put_nowait(None)
+            return
+        buf.extend(data)
+        while (i := buf.find(b'\n')) != -1:
+            lines.put_nowait(bytes(buf[:i]))
+            del buf[:i + 1]
+
+    # The event loop wakes us only when the user has typed something; no input() thread
+    loop.add_reader(stdin_fd, on_stdin)
     try:
-        ser = serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=1)
+        while True:
+            msg = await lines.get()  # Read user input
+            if msg is None or msg.strip().lower() == b"exit":
+                break
+            writer.write(msg + b'\n')  # Send message to Arduino
+            await writer.drain()
+    finally:
+        loop.remove_reader(stdin_fd)
+
+async def main():
+    try:
+        reader, writer = await serial_asyncio_fast.open_serial_connection(url=SERIAL_PORT, baudrate=BAUD_RATE)
         print(f"Connected to {SERIAL_PORT} at {BAUD_RATE} baud.")
-    except serial.SerialException as e:
+    except OSError as e:
         print(f"Error opening serial port: {e}")
         return
 
-    # Start thread to read from serial
-    thread = threading.Thread(target=read_from_serial, args=(ser,), daemon=True)
-    thread.start()
+    read_task = asyncio.create_task(read_from_serial(reader))
+    write_task = asyncio.create_task(write_to_serial(writer))
 
     try:
-        while True:
-            msg = input()  # Read user input
-            if msg.lower() == "exit":
-                break
-            ser.write((msg + '\n').encode())  # Send message to Arduino
-    except KeyboardInterrupt:
-        print("\nExiting...")
-
-    ser.close()
+        # Stop as soon as the user types "exit" (or the port goes away)
+        await asyncio.wait({read_task, write_task}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        read_task.cancel()
+        write_task.cancel()
+        writer.close()
 
 if __name__ == '__main__':
     print("Start")
-    main()
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("\nExiting...")
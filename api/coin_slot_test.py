@@ -1,19 +1,45 @@
-import RPi.GPIO as GPIO
+import gpiod
+from gpiod.line import Bias, Direction, Edge
+import threading
 import time
+from datetime import timedelta
 
 COIN_PIN = 17  # Change to your actual GPIO pin
-GPIO.setmode(GPIO.BCM)
-GPIO.setup(COIN_PIN, GPIO.IN)
-GPIO.setwarnings(False)
+DEBOUNCE_NS = 8_000_000  # Reject edges closer together than this (software debounce)
+COIN_GAP_S = 0.15  # Quiet period after the last pulse that marks the end of a coin
+
+# Kernel-side edge detection and debounce; events are queued with timestamps
+request = gpiod.request_lines(
+    "/dev/gpiochip0",
+    consumer="coin-slot",
+    config={COIN_PIN: gpiod.LineSettings(
+        direction=Direction.INPUT,
+        bias=Bias.PULL_UP,
+        edge_detection=Edge.FALLING,
+        debounce_period=timedelta(milliseconds=5),
+    )},
+)
 
 coin_count = 0  # Global variable to store the count
 pulse_count = 0
+last_edge_ns = None
+coin_timer = None
+lock = threading.Lock()
 
-def count_pulse(channel):
-    """Callback function for each pulse received."""
-    global pulse_count
-    pulse_count += 1
-    print(pulse_count)
+def count_pulse(timestamp_ns):
+    """Handle each pulse received."""
+    global pulse_count, last_edge_ns, coin_timer
+    with lock:
+        if last_edge_ns is not None and timestamp_ns - last_edge_ns < DEBOUNCE_NS:
+            return
+        last_edge_ns = timestamp_ns
+        pulse_count += 1
+        print(pulse_count)
+        # Restart the quiet-period timer; when it fires the coin is complete
+        if coin_timer:
+            coin_timer.cancel()
+        coin_timer = threading.Timer(COIN_GAP_S, coin_inserted)
+        coin_timer.start()
 
 def check_coin_slot_interrupt():
     global pulse_count
@@ -27,23 +53,29 @@ def check_coin_slot_interrupt():
             current_coin_value = 10  # 10 Pesos
         else:
             current_coin_value = 0  # Unknown coin
-        # Add logic here to handle the coin insertion 
+        # Add logic here to handle the coin insertion
         # (e.g., update a counter, dispense a product, etc.)
         pulse_count = 0  # Reset pulse count for the next coin
         return current_coin_value
     return 0
-    
+
 def coin_inserted():
     global coin_count
-    coin_count += check_coin_slot_interrupt()
+    with lock:
+        coin_count += check_coin_slot_interrupt()
     print(f"Coin detected! Total: {coin_count}")
 
-# Detect falling edge (coin pulse)
-GPIO.add_event_detect(COIN_PIN, GPIO.FALLING, callback=count_pulse, bouncetime=10)
-
-if __name__ == '__main__':
+def read_edges():
+    """Drain falling-edge (coin pulse) events queued by the kernel."""
     while True:
-        pass
-    #    coin_inserted()
-    #    time.sleep(1)
+        if request.wait_edge_events(timedelta(seconds=1)):
+            for event in request.read_edge_events():
+                count_pulse(event.timestamp_ns)
 
+if __name__ == '__main__':
+    threading.Thread(target=read_edges, daemon=True).start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        request.release()
@@ -1,15 +1,22 @@
-import RPi.GPIO as GPIO
+#import RPi.GPIO as GPIO
 #import lgpio as GPIO
+import gpiod
+from gpiod.line import Direction, Value
 import time
 
+# Character-device GPIO (libgpiod v2); opened once and shared by all hoppers
+GPIO_CHIP = gpiod.Chip("/dev/gpiochip0")
+
 class CoinDispenser:
     #coin_dispensed = False
     def __init__(self, pin, sensor_pin=23, duration=2):
         self.pin = pin
         self.duration = duration
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setup(self.pin, GPIO.OUT)
-        GPIO.output(self.pin, GPIO.HIGH)
+        # Output line, starts HIGH (idle); each toggle is a single ioctl
+        self.request = GPIO_CHIP.request_lines(
+            config={pin: gpiod.LineSettings(direction=Direction.OUTPUT, output_value=Value.ACTIVE)},
+            consumer=f"coin-dispenser-{pin}",
+        )
         #self.sensor_pin = sensor_pin
         #GPIO.setup(self.sensor_pin, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
         #GPIO.add_event_detect(self.sensor_pin, GPIO.FALLING, callback=self.check_coin_dispensed, bouncetime=100)        
@@ -18,18 +25,24 @@ class CoinDispenser:
     #    coin_dispensed = True
 
     def dispense_coin_start(self):
-        GPIO.output(self.pin, GPIO.LOW)
+        self.request.set_value(self.pin, Value.INACTIVE)
         #while not coin_dispensed:
         #    pass
         #for i in range(count):
         #    time.sleep(self.duration)
 
+    def dispense_coin(self, count):
+        for _ in range(count):
+            self.dispense_coin_start()
+            time.sleep(self.duration)
+            self.dispense_coin_end()
+
     def dispense_coin_end(self):
-        GPIO.output(self.pin, GPIO.HIGH)
+        self.request.set_value(self.pin, Value.ACTIVE)
         print(f"Coin dispensed from GPIO{self.pin}!")
 
     def cleanup(self):
-        GPIO.cleanup(self.pin)
+        self.request.release()
 
 
 coins = {
@@ -37,16 +50,17 @@ coins = {
     5: CoinDispenser(pin=7, duration=2),
     10: CoinDispenser(pin=1, duration=2),
 }
+# Denominations are fixed (10, 5, 1); bind the hoppers once for dispense_amount
+_c10, _c5, _c1 = coins[10], coins[5], coins[1]
 
 
 def dispense_amount(amount):
     """Determines the number of each coin needed to match the given amount."""
-    global coins
-    for value in sorted(coins.keys(), reverse=True):
-        count = amount // value
-        if count > 0:
-            coins[value].dispense_coin(count)
-            amount -= count * value
+    n10, amount = divmod(amount, 10)
+    n5, n1 = divmod(amount, 5)
+    if n10: _c10.dispense_coin(n10)
+    if n5:  _c5.dispense_coin(n5)
+    if n1:  _c1.dispense_coin(n1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,74 @@
+"""
+End-of-reply rules for the src/main-final line protocol, shared by api/main.py
+(str lines) and serial_manager.AsyncSerialManager (bytes lines).
+
+Each command's reply ends on a known line; an "ERR ..." line ends any reply unless
+noted. The rules are written once in _build() and instantiated for both line types.
+"""
+from typing import Callable
+
+# What the device prints when STOP interrupts a payout (raw line)
+LINE_STOPPED = b"OK STOPPED"
+
+def _build(lit: Callable[[str], object]) -> Callable:
+    """Make terminator_for() for lines of the type lit() turns a str literal into"""
+    ERR = lit("ERR")
+    ERR_TIMEOUT = lit("ERR TIMEOUT")
+    DONE = lit("DONE ")
+    DONE_CHANGE = lit("DONE CHANGE ")
+    TARGET_REACHED = lit("TARGET REACHED")
+    STOPPED = lit(LINE_STOPPED.decode())
+
+    def single_line(line) -> bool:
+        return True  # The one line may itself be an ERR
+
+    def until_err(line) -> bool:
+        return line.startswith(ERR)
+
+    def until_hopper_done(line) -> bool:
+        # "DONE HOPPER" is followed by "DONE <d> TARGET REACHED! <n>" or "ERR TIMEOUT ..."
+        return line.startswith(ERR) or line == STOPPED or (
+            line.startswith(DONE) and TARGET_REACHED in line)
+
+    def until_change_done(line) -> bool:
+        # CHANGE first acks with a bare "DONE CHANGE" (no amount); batched HOPPER sends no ack.
+        # Both then run the hoppers in turn, each printing "Hopper <d> ..." status lines,
+        # "OUT <d> Count: ..." per coin and "DONE HOPPER" + "DONE <d> TARGET REACHED! <n>"
+        # or "ERR TIMEOUT ..." (which only moves on to the next hopper), and end on
+        # "DONE CHANGE <amt>" (note the space) or "ERR CHANGE_TIMEOUT"
+        return line.startswith(DONE_CHANGE) or line == STOPPED or (
+            line.startswith(ERR) and not line.startswith(ERR_TIMEOUT))
+
+    reset_ok = lit("OK RESET")
+    paper_bits = (lit("1"), lit("0"))
+    paper_done = lit("DONE PAPER")
+    coinslot_ok = (lit("OK COINSLOT"), ERR)
+    table = {
+        lit("COINS?"): single_line,
+        lit("STATUS?"): single_line,
+        lit("RESET"): lambda line: line == reset_ok or line.startswith(ERR),
+        lit("STOP"): lambda line: line == STOPPED or line.startswith(ERR),
+        # Sensor status lines, then "1" or "0"
+        lit("PAPER?"): lambda line: line in paper_bits or line.startswith(ERR),
+        lit("PAPER"): lambda line: line == paper_done or line.startswith(ERR),
+        lit("COINSLOT"): lambda line: line.startswith(coinslot_ok),
+        lit("HOPPER"): until_hopper_done,
+        lit("CHANGE"): until_change_done,
+    }
+    hopper = lit("HOPPER")
+
+    def terminator_for(cmd):
+        """Pick, once per command, the predicate that recognizes the last line of its reply"""
+        parts = cmd.split()
+        if not parts:
+            return until_err
+        if parts[0] == hopper and len(parts) > 3:
+            return until_change_done  # HOPPER <d> <n> <d> <n> ...
+        return table.get(parts[0], until_err)
+
+    return terminator_for
+
+# str commands and decoded lines
+terminator_for = _build(str)
+# bytes commands and raw lines
+terminator_for_bytes = _build(str.encode)
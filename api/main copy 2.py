@@ -1,8 +1,9 @@
 # main.py — FastAPI brain that talks to Arduino via serial (no GPIO on Pi)
 
+import asyncio
 import json
-import time
-from typing import Any, Dict, Optional
+import re
+from typing import Any, Dict, Optional, Union
 from serial_manager import SerialManager
 
 from fastapi import FastAPI, HTTPException
@@ -11,14 +12,13 @@ from fastapi.middleware.cors import CORSMiddleware
 # If you still want to reuse your existing Item model, keep this import:
 from include.item_model import Item
 
-import serial
-
 # ---------- Serial Setup ----------
 # Adjust the port if needed; on some Pis/boards it could be /dev/ttyUSB0
 SERIAL_PORT = "/dev/ttyACM0"
 BAUD = 115200
 
 # 'timeout' makes readline() return after that many seconds even if no '\n'
+# The port itself is opened in the startup hook below, not at import
 serial_mgr = SerialManager(SERIAL_PORT, BAUD)
 
 # ---------- FastAPI ----------
@@ -31,42 +31,68 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Fixed commands, pre-encoded once
+CMD_GET = b"get\n"
+CMD_RESET = b"reset\n"
+CMD_COINSLOT_START = b"coinslot_start\n"
+CMD_COINSLOT_STOP = b"coinslot_stop\n"
+
+# Serializes access to the port across concurrent requests
+_serial_lock = asyncio.Lock()
+
+# In-flight "get" exchange shared by concurrent /coins callers
+_pending_get: Optional[asyncio.Task] = None
+
+# ---------- Lifecycle ----------
+
+@app.on_event("startup")
+async def _open_serial():
+    # Open once per process; run with a single worker so only one process owns the port
+    await asyncio.to_thread(serial_mgr.connect)
+
+@app.on_event("shutdown")
+async def _close_serial():
+    await asyncio.to_thread(serial_mgr.close)
+
 # ---------- Helpers ----------
 
+def _send_bytes(payload: bytes) -> None:
+    """Send an already-encoded, newline-terminated command to Arduino."""
+    # Drop stale bytes in one tcflush instead of a read() per fragment;
+    # _read_response waits for the reply, so no settle sleep is needed.
+    # Looked up per call: serial_mgr replaces ser when it reconnects
+    ser = serial_mgr.ser
+    ser.reset_input_buffer()
+    ser.write(payload)
+    ser.flush()
+
 def _send(cmd: str) -> None:
     """Send a single-line command to Arduino (newline-terminated)."""
-    while ser.in_waiting > 0:
-        ser.read(ser.in_waiting)
     if not cmd.endswith("\n"):
         cmd += "\n"
-    ser.write(cmd.encode("utf-8"))
-    ser.flush()
-    time.sleep(0.1)
+    _send_bytes(cmd.encode("utf-8"))
 
 def _read_response(timeout: float = 3.0) -> str:
-    """Read multiple lines until timeout or empty line"""
-    result = []
-    end = time.time() + timeout
-    while time.time() < end:
-        line = ser.readline().decode("utf-8", "ignore").strip()
-        if line:
-            result.append(line)
-            # Option 1: Stop after empty line
-            if len(result) > 0 and not line:
-                break
-            # Option 2: Look for a completion marker
-            if line == "END" or line.endswith("}"):
-                break
-    return "\n".join(result)
-
-def _send_and_wait(cmd: str, expect_json: bool = True, timeout: float = 5.0) -> Dict[str, Any]:
+    """
+    Read one framed reply (STX, 2-byte little-endian body length, JSON body), with the
+    same frame parser serial_mgr.send_command uses.
+    Returns "" if no complete frame arrives before the timeout.
+    """
+    body = serial_mgr.read_frame(timeout)
+    return body.decode("utf-8", "ignore") if body is not None else ""
+
+def _send_and_wait(cmd: Union[str, bytes], expect_json: bool = True, timeout: float = 5.0) -> Dict[str, Any]:
     """
     Send a command and wait for one response line.
     If expect_json is True, parse JSON; raise 502 if invalid or error reported.
     If not JSON (e.g., 'get' may return a plain integer from your older coinslot),
     we return {"raw": "<line>"} and the caller can interpret it.
     """
-    _send(cmd)
+    if isinstance(cmd, bytes):
+        _send_bytes(cmd)
+        cmd = cmd.decode()
+    else:
+        _send(cmd)
     line = _read_response(timeout=timeout)
     if line is None:
         raise HTTPException(status_code=504, detail=f"Timeout waiting for reply to '{cmd.strip()}'")
@@ -86,119 +112,117 @@ def _send_and_wait(cmd: str, expect_json: bool = True, timeout: float = 5.0) ->
     # Not expecting JSON: return raw line
     return {"raw": line}
 
-def _parse_coins_from_reply(reply: Dict[str, Any]) -> int:
+# Matches the JSON field ({"ok":true,"cmd":"get_coins","coins":7}) or a legacy bare integer ("7")
+_COIN_RE = re.compile(r'"coins"\s*:\s*(\d+)|^\s*(\d+)\s*$', re.MULTILINE)
+
+def _parse_coins_from_reply(raw: str) -> int:
     """
     Accepts either the JSON your new firmware prints (e.g., {"ok":true,"cmd":"get_coins","coins":7})
     OR legacy plain integer string from your old CoinSlot code (e.g., "7").
+    The reply format is fixed, so a regex on the raw text avoids a JSON decode.
     """
-    # JSON path
-    if "coins" in reply:
-        try:
-            return int(reply["coins"])
-        except Exception:
-            pass
-    # Raw integer fallback
-    if "raw" in reply:
-        s = str(reply["raw"]).strip()
-        if s.isdigit():
-            return int(s)
-        # Sometimes raw could be JSON-as-text; try decoding:
-        try:
-            obj = json.loads(s)
-            if isinstance(obj, dict) and "coins" in obj:
-                return int(obj["coins"])
-        except Exception:
-            pass
+    m = _COIN_RE.search(raw)
+    if m:
+        return int(m.group(1) or m.group(2))
     # Couldn’t parse
-    raise HTTPException(status_code=502, detail=f"Unexpected coin reply: {reply}")
+    raise HTTPException(status_code=502, detail=f"Unexpected coin reply: {raw!r}")
+
+async def _serial_call(fn, *args, **kwargs):
+    """
+    Run a blocking serial helper on a worker thread, one at a time.
+    Keeps the event loop free while the Arduino is busy (e.g. dispensing).
+    """
+    async with _serial_lock:
+        return await asyncio.to_thread(fn, *args, **kwargs)
 
 # ---------- Routes ----------
 
 @app.get("/health")
-def health():
+async def health():
     return {"status": "ok"}
 
 @app.post("/coinslot/start")
-def coinslot_start():
-    response = serial_mgr.send_command("coinslot_start", expect_json=True, timeout=1.0)
+async def coinslot_start():
+    response = await _serial_call(serial_mgr.send_command, CMD_COINSLOT_START, expect_json=True, timeout=1.0)
     return response
 
 @app.post("/coinslot/stop")
-def coinslot_stop():
+async def coinslot_stop():
     # Replace the old _send_and_wait call with serial_mgr
-    response = serial_mgr.send_command("coinslot_stop", expect_json=True, timeout=1.0)
+    response = await _serial_call(serial_mgr.send_command, CMD_COINSLOT_STOP, expect_json=True, timeout=1.0)
     return response
 
+def _clear_pending_get(_task: asyncio.Task) -> None:
+    global _pending_get
+    _pending_get = None
+
 @app.get("/coins")
-def get_coin_count():
+async def get_coin_count():
     """
     Ask Arduino for current inserted coins.
     Uses robust serial manager with retry logic.
     """
-    response = serial_mgr.send_command("get", expect_json=False)
+    global _pending_get
+    # Coalesce: while one "get" is on the wire, later pollers await the same reply
+    if _pending_get is None:
+        _pending_get = asyncio.create_task(
+            _serial_call(serial_mgr.send_command, CMD_GET, expect_json=False))
+        _pending_get.add_done_callback(_clear_pending_get)
+    # shield: one client disconnecting must not cancel the shared exchange
+    response = await asyncio.shield(_pending_get)
     
     if "error" in response:
         # Return a fallback value during errors (optional)
         # return {"coins": 0, "error": response["error"]}
         raise HTTPException(status_code=503, detail=response["error"])
     
-    # Parse coins from response
-    if "raw" in response:
-        s = str(response["raw"]).strip()
-        if s.isdigit():
-            return {"coins": int(s)}
-        # Try parsing as JSON in raw text
-        try:
-            obj = json.loads(s)
-            if isinstance(obj, dict) and "coins" in obj:
-                return {"coins": int(obj["coins"])}
-        except Exception:
-            pass
-    
-    # Couldn't parse
-    raise HTTPException(status_code=502, detail=f"Unexpected coin reply: {response}")
+    return {"coins": _parse_coins_from_reply(response.get("raw", ""))}
 
 @app.post("/reset-coins")
-def reset_coins():
+async def reset_coins():
     # New firmware replies with JSON; older code might reply nothing.
     try:
-        r = serial_mgr.send_command("reset", expect_json=False)
+        r = await _serial_call(serial_mgr.send_command, CMD_RESET, expect_json=False)
     except HTTPException:
         # Fallback: even if no JSON, consider it reset if Arduino is alive
         r = {"ok": True}
     return {"message": "Coin count reset", "reply": r}
 
 @app.post("/dispense/paper/{paper}/{qty}")
-def dispense_paper(paper: str, qty: int):
+async def dispense_paper(paper: str, qty: int):
     if paper.upper() not in ("A4", "LONG"):
         raise HTTPException(status_code=400, detail="paper must be A4 or LONG")
     if qty <= 0:
         raise HTTPException(status_code=400, detail="qty must be > 0")
     cmd = f"paper {paper.upper()} {qty}"
-    r = _send_and_wait(cmd, expect_json=True, timeout=max(5.0, 10.0 * qty))  # allow longer for multiple sheets
+    r = await _serial_call(_send_and_wait, cmd, expect_json=True, timeout=max(5.0, 10.0 * qty))  # allow longer for multiple sheets
     return r
 
 @app.post("/dispense/coin/{value}/{count}")
-def dispense_coin(value: int, count: int):
+async def dispense_coin(value: int, count: int):
     if value not in (1, 5, 10):
         raise HTTPException(status_code=400, detail="value must be 1, 5, or 10")
     if count <= 0:
         raise HTTPException(status_code=400, detail="count must be > 0")
     cmd = f"dispense_coin {value} {count}"
     # Arduino stops on target reached OR timeout if no coin detected
-    r = _send_and_wait(cmd, expect_json=True, timeout=max(6.0, 6.0 * count))
+    r = await _serial_call(_send_and_wait, cmd, expect_json=True, timeout=max(6.0, 6.0 * count))
     return r
 
 @app.post("/dispense/amount/{amount}")
-def dispense_amount(amount: int):
+async def dispense_amount(amount: int):
     if amount < 0:
         raise HTTPException(status_code=400, detail="amount must be >= 0")
     cmd = f"dispense_amount {amount}"
-    r = _send_and_wait(cmd, expect_json=True, timeout=max(6.0, 2.0 * amount))
+    r = await _serial_call(_send_and_wait, cmd, expect_json=True, timeout=max(6.0, 2.0 * amount))
     return r
 
 @app.post("/buy")
-def buy(item: Item):
+async def buy(item: Item):
+    # The whole transaction holds the port so no other command interleaves
+    return await _serial_call(_buy, item)
+
+def _buy(item: Item) -> Dict[str, Any]:
     """
     Transaction flow:
       1) Read inserted coins.
@@ -208,8 +232,9 @@ def buy(item: Item):
     NOTE: Your original code was using 'quantity' as the price.
     """
     # 1) coins inserted
-    coins_reply = _send_and_wait("get", expect_json=True, timeout=2.5)
-    coins = _parse_coins_from_reply(coins_reply)
+    # Only structured acks need JSON; the coin reply is matched on the raw text
+    _send_bytes(CMD_GET)
+    coins = _parse_coins_from_reply(_read_response(timeout=2.5))
 
     price = int(item.quantity)
     change = coins - price
@@ -232,7 +257,7 @@ def buy(item: Item):
 
     # 4) reset
     try:
-        reset_reply = _send_and_wait("reset", expect_json=True, timeout=3.0)
+        reset_reply = _send_and_wait(CMD_RESET, expect_json=True, timeout=3.0)
     except HTTPException:
         reset_reply = {"ok": True}
 
@@ -251,4 +276,5 @@ def buy(item: Item):
 # If you run: python3 main.py
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # One worker: there is a single serial port, and a second process would fight over it
+    uvicorn.run(app, host="0.0.0.0", port=8000, loop="uvloop", http="httptools", workers=1)
@@ -1,5 +1,7 @@
 import RPi.GPIO as GPIO
 #import lgpio as GPIO
+import asyncio
+import threading
 import time
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
@@ -7,13 +9,14 @@ from fastapi.middleware.cors import CORSMiddleware
 from include.config import a4_step_motors, long_step_motors
 from include.dispenser_final import PaperDispenser
 from include.item_model import Item
-from include.coin_dispenser import CoinDispenser
+# Coin dispensers are shared: include.coin_dispenser owns the GPIO line requests
+from include.coin_dispenser import coins as coin_dispensers
 
 import uvicorn
 # for connecting to Arduino Coinslot
 import serial
 
-ser = serial.Serial('/dev/ttyACM0', 115200)
+ser = None  # opened in the startup hook, once per process
 
 GPIO.setmode(GPIO.BCM)
 app = FastAPI()
@@ -30,12 +33,14 @@ app.add_middleware(
 # Set Pin Numbers Here:
 COIN_PIN = 17  # Change to your actual GPIO pin
 coin_hopper_state_pin = 26 #TODO
-coin_dispensed = False
+COIN_DISPENSE_TIMEOUT = 2.0  # seconds to wait for the hopper sensor before giving up
+# One release per coin seen by the hopper sensor. All hoppers share this one sensor
+# pin, so an edge can't be attributed to a hopper: only one may run at a time.
+coin_dispensed = threading.Semaphore(0)
 GPIO.setup(coin_hopper_state_pin, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
 
 def coin_dispense_detected(channel):
-    global coin_dispensed
-    coin_dispensed = True
+    coin_dispensed.release()
     print("CALLED")
 
 GPIO.add_event_detect(coin_hopper_state_pin, GPIO.FALLING, callback=coin_dispense_detected, bouncetime=300)
@@ -46,33 +51,35 @@ GPIO.setwarnings(False)
 
 coin_count = 0  # Global variable to store the count
 pulse_count = 0
+last_pulse_ns = 0
+PULSE_DEBOUNCE_NS = 8_000_000  # bouncetime alone is not honored under load
 
 dispensers = {
 "A4": PaperDispenser(a4_step_motors['stepper'], a4_step_motors['dc_motor']),
 "LONG": PaperDispenser(long_step_motors['stepper'], long_step_motors['dc_motor'])
 }
 
-# Define coin dispensers for different values
-coins = {
-    1: CoinDispenser(pin=8, duration=2),
-    5: CoinDispenser(pin=7, duration=2),
-    10: CoinDispenser(pin=1, duration=2),
-}
-def dispense_amount(amount):
+async def _dispense(dispenser, count):
+    """Pulse one hopper count times without blocking the event loop."""
+    for _ in range(count):
+        dispenser.dispense_coin_start()
+        # Stop as soon as the coin drops instead of after a fixed delay
+        if not await asyncio.to_thread(coin_dispensed.acquire, timeout=COIN_DISPENSE_TIMEOUT):
+            print(f"Hopper stall on GPIO{dispenser.pin}")
+        dispenser.dispense_coin_end()
+
+async def dispense_amount(amount):
     """Determines the number of each coin needed to match the given amount."""
-    global coins
-    global coin_dispensed
-    for value in sorted(coins.keys(), reverse=True):
-        count = amount // value
-        if count > 0:
-            for i in range(count):
-                coins[value].dispense_coin_start()
-                time.sleep(1)
-                #while not coin_dispensed:
-                #    pass
-                #coin_dispensed = False
-                coins[value].dispense_coin_end()
-            amount -= count * value
+    # Discard sensor edges left over from before this payout
+    while coin_dispensed.acquire(blocking=False):
+        pass
+    n10, amount = divmod(amount, 10)
+    n5, n1 = divmod(amount, 5)
+    # One hopper at a time: they share the drop sensor, so a coin from one hopper
+    # would otherwise end another hopper's pulse
+    for denom, n in ((10, n10), (5, n5), (1, n1)):
+        if n:
+            await _dispense(coin_dispensers[denom], n)
 
 
 def check_coin_slot_interrupt():
@@ -111,7 +118,11 @@ def coin_inserted():
 
 def count_pulse(channel):
     """Callback function for each pulse received."""
-    global pulse_count
+    global pulse_count, last_pulse_ns
+    now = time.monotonic_ns()
+    if now - last_pulse_ns < PULSE_DEBOUNCE_NS:
+        return
+    last_pulse_ns = now
     pulse_count += 1
     print(pulse_count)
 
@@ -120,6 +131,21 @@ GPIO.setup(COIN_PIN, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
 GPIO.add_event_detect(COIN_PIN, GPIO.FALLING, callback=count_pulse, bouncetime=5)
 
 
+@app.on_event("startup")
+async def open_serial():
+    global ser
+    ser = serial.Serial('/dev/ttyACM0', 115200)
+    try:
+        ser.set_low_latency_mode(True)
+    except (AttributeError, ValueError) as e:
+        # Not supported on this platform/driver (e.g. CDC-ACM, CH340); keep default latency
+        print(f"Low-latency mode unavailable on {ser.port}: {e}")
+
+@app.on_event("shutdown")
+async def close_serial():
+    if ser:
+        ser.close()
+
 # ROUTES
 @app.get("/coins")
 def get_coin_count():
@@ -144,7 +170,7 @@ async def get_coin_count(item: Item):
         change = coin_count - item.quantity
         if (change >= 0):
             dispensers[item.paper].dispense(item.quantity)
-            dispense_amount(change)
+            await dispense_amount(change)
             coin_count = 0
             ser.write('reset\n'.encode())
         else:
@@ -166,7 +192,7 @@ if __name__ == "__main__":
     #time.sleep(3)
     #dispensers["LONG"].dispense(1)
     #coin_dispensed = True
-    dispense_amount(10)
+    asyncio.run(dispense_amount(10))
     #while True:
     #    print("VALUE:", GPIO.input(coin_hopper_state_pin))
 
@@ -1,10 +1,18 @@
+import os
 import time
+import functools
+import queue
+import logging
+import logging.handlers
 import threading
 import serial
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Callable
+from line_protocol import terminator_for
 
+from anyio import to_thread
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
 import uvicorn
 
 # Serial port configuration
@@ -12,6 +20,13 @@ SERIAL_PORT = '/dev/ttyACM0'  # Default Arduino port on Raspberry Pi
 BAUDRATE = 115200  # As specified in cmd.txt
 TIMEOUT = 1.0
 
+# Sync endpoints run in the threadpool but all serialize on the one serial port,
+# so a few threads are enough; extra requests wait for a token instead of a thread
+THREADPOOL_SIZE = 8
+
+# How long /health may reuse the last STATUS? reply
+HEALTH_STATUS_TTL = 0.5
+
 # Initialize FastAPI
 app = FastAPI(title="Bondpaper Machine API", version="1.0")
 
@@ -24,6 +39,25 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+class CachedTimeFormatter(logging.Formatter):
+    """Formatter that runs strftime at most once per second"""
+    def __init__(self, fmt: str, datefmt: str):
+        super().__init__(fmt, datefmt)
+        self._ts_epoch = None
+        self._ts_str = ""
+
+    def formatTime(self, record: logging.LogRecord, datefmt: Optional[str] = None) -> str:
+        now = int(record.created)
+        if now != self._ts_epoch:
+            self._ts_str = time.strftime(self.datefmt, self.converter(now))
+            self._ts_epoch = now
+        return self._ts_str
+
+@functools.lru_cache(maxsize=64)
+def _encode(cmd: str) -> bytes:
+    """Newline-terminated wire bytes for a command, cached for the repeated ones"""
+    return (cmd if cmd.endswith('\n') else cmd + '\n').encode('utf-8')
+
 # Serial connection manager
 class SerialManager:
     def __init__(self, port: str, baud: int, timeout: float = 0.5):
@@ -35,7 +69,30 @@ class SerialManager:
         self.connected = False
         self.last_error = None
         self.log_file = "serial_communication.log"
-        self.connect()
+        # True when the last reply ended on its terminator with nothing read past it,
+        # so the next command can skip the stale-input check
+        self._buffer_clean = False
+        # (monotonic time, reply) of the last STATUS? answered for /health
+        self._status_cache = (0.0, None)
+        self._setup_logger()
+        # The port is opened by connect() in the startup hook (or lazily by the first
+        # command), so importing this module never touches the device
+
+    def _setup_logger(self) -> None:
+        """
+        Callers only enqueue log records; a QueueListener thread formats them
+        and writes the file, so no log I/O happens while holding the serial lock
+        """
+        # Rotate so the log (and /logs reads of it) stays bounded over the machine's lifetime
+        file_handler = logging.handlers.RotatingFileHandler(self.log_file, maxBytes=5_000_000, backupCount=5)
+        file_handler.setFormatter(CachedTimeFormatter("[%(asctime)s] %(message)s", "%Y-%m-%d %H:%M:%S"))
+        log_queue = queue.Queue(-1)
+        self.logger = logging.getLogger("serial")
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        self.logger.handlers = [logging.handlers.QueueHandler(log_queue)]
+        self.log_listener = logging.handlers.QueueListener(log_queue, file_handler)
+        self.log_listener.start()
     
     def connect(self) -> bool:
         with self.lock:
@@ -43,7 +100,7 @@ class SerialManager:
                 # Close if already open
                 if self.ser and self.ser.is_open:
                     self.ser.close()
-                    self.log_message("SYSTEM", f"Closed existing connection to {self.port}")
+                    self.logger.info("SYSTEM: Closed existing connection to %s", self.port)
                     time.sleep(0.3)
                 
                 # Create new connection
@@ -59,13 +116,14 @@ class SerialManager:
                 self.ser.flush()
                 
                 self.connected = True
+                self._buffer_clean = False
                 self.last_error = None
-                self.log_message("SYSTEM", f"Successfully connected to {self.port} at {self.baud} baud")
+                self.logger.info("SYSTEM: Successfully connected to %s at %s baud", self.port, self.baud)
                 return True
             
             except Exception as e:
                 self.last_error = f"Serial connection error: {e}"
-                self.log_message("ERROR", f"Connection failed: {e}")
+                self.logger.info("ERROR: Connection failed: %s", e)
                 print(self.last_error)
                 self.connected = False
                 return False
@@ -82,95 +140,25 @@ class SerialManager:
         Returns:
             Dictionary with response lines or error
         """
-        if not self.connected and not self.connect():
-            return {"error": f"Not connected to {self.port}"}
+        result = self._send_and_wait(cmd, terminator_for(cmd) if wait_for_response else None, timeout)
+        if "lines" not in result:
+            return result
         
-        with self.lock:
-            try:
-                # Clear input buffer
-                if self.ser.in_waiting > 0:
-                    cleared_data = self.ser.read(self.ser.in_waiting).decode('utf-8', 'ignore').strip()
-                    if cleared_data:
-                        self.log_message("CLEARED", cleared_data)
-                
-                # Send command with newline if needed
-                if not cmd.endswith('\n'):
-                    cmd += '\n'
-                self.ser.write(cmd.encode('utf-8'))
-                self.ser.flush()
-                
-                # Log the sent command
-                self.log_message("SEND", cmd)
-                
-                if not wait_for_response:
-                    return {"success": True}
-                
-                # Read response with timeout
-                response_lines = []
-                end_time = time.time() + timeout
-                
-                while time.time() < end_time:
-                    if self.ser.in_waiting > 0:
-                        line = self.ser.readline().decode('utf-8', 'ignore').strip()
-                        if line:
-                            # Log the received response
-                            self.log_message("RECV", line)
-                            response_lines.append(line)
-                            # If we got an error response, we can stop reading
-                            if line.startswith("ERR"):
-                                break
-                            # For commands that return a specific value and don't need more lines
-                            if cmd.strip() in ["COINS?", "STATUS?"] and not line.startswith("ERR"):
-                                break
-                            # For paper command, look for "DONE PAPER" response
-                            if cmd.strip().startswith("PAPER") and line == "DONE PAPER":
-                                break
-                            # For change command, look for "DONE CHANGE" response
-                            if cmd.strip().startswith("CHANGE") and line.startswith("DONE CHANGE"):
-                                break
-                            if cmd.strip().startswith("HOPPER") and line.startswith("DONE HOPPER"):
-                                break
-                    else:
-                        time.sleep(0.01)  # Short sleep to avoid CPU spinning
-                        # If we have at least one response and no data for a while, consider done
-                        if response_lines and (time.time() - end_time) > -0.5:
-                            break
-                
-                # Process response
-                if not response_lines:
-                    self.log_message("ERROR", "No response from device")
-                    return {"error": "No response from device"}
-                
-                # Return all response lines
-                return {"response": response_lines}
-                
-            except serial.SerialException as e:
-                self.connected = False
-                error_msg = f"Serial error: {e}"
-                print(error_msg)
-                return {"error": error_msg}
-    
-    def log_message(self, direction: str, message: str) -> None:
-        """
-        Log a message to the log file
+        # Without a terminator, whatever arrived before the timeout is the reply
+        if not result["lines"]:
+            self.logger.info("ERROR: No response from device")
+            return {"error": "No response from device"}
         
-        Args:
-            direction: "SEND" or "RECV" to indicate direction
-            message: The message content
-        """
-        timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-        try:
-            with open(self.log_file, "a") as f:
-                log_entry = f"[{timestamp}] {direction}: {message.strip()}\n"
-                f.write(log_entry)
-        except Exception as e:
-            print(f"Error writing to log file: {e}")
-                
+        # Return all response lines
+        return {"response": result["lines"]}
+    
     def close(self) -> None:
         with self.lock:
             if self.ser and self.ser.is_open:
                 self.ser.close()
                 self.connected = False
+        # Drain queued log records to the file
+        self.log_listener.stop()
                 
     def send_command_with_predicate(self, cmd: str, predicate, timeout: float = 5.0) -> Dict[str, Any]:
         """
@@ -184,34 +172,7 @@ class SerialManager:
         Returns:
             Dictionary with success status and response or error message
         """
-        if not self.connected and not self.connect():
-            return {"error": f"Not connected to {self.port}"}
-        
-        with self.lock:
-            try:
-                # Clear input buffer
-                if self.ser.in_waiting > 0:
-                    cleared_data = self.ser.read(self.ser.in_waiting).decode('utf-8', 'ignore').strip()
-                    if cleared_data:
-                        self.log_message("CLEARED", cleared_data)
-                
-                # Send command with newline if needed
-                if not cmd.endswith('\n'):
-                    cmd += '\n'
-                self.ser.write(cmd.encode('utf-8'))
-                self.ser.flush()
-                
-                # Log the sent command
-                self.log_message("SEND", cmd)
-                
-                # Now wait for the predicate match
-                return self.wait_for_predicate(predicate, timeout)
-                
-            except serial.SerialException as e:
-                self.connected = False
-                error_msg = f"Serial error: {e}"
-                print(error_msg)
-                return {"error": error_msg}
+        return self._predicate_result(self._send_and_wait(cmd, predicate, timeout))
     
     def wait_for_predicate(self, predicate, timeout: float = 5.0) -> Dict[str, Any]:
         """
@@ -229,36 +190,107 @@ class SerialManager:
             
         with self.lock:
             try:
-                response_lines = []
-                end_time = time.time() + timeout
+                lines, matched = self._read_lines(predicate, timeout)
+            except serial.SerialException as e:
+                return self._serial_error(e)
+        return self._predicate_result({"lines": lines, "matched": matched})
+    
+    def _send_and_wait(self, cmd: str, predicate: Optional[Callable[[str], bool]], timeout: float) -> Dict[str, Any]:
+        """
+        Write a command, then read lines until predicate matches or the timeout runs out.
+        With predicate=None, returns {"success": True} right after the write.
+        
+        Returns:
+            {"lines": [...], "matched": bool}, {"success": True} or {"error": ...}
+        """
+        if not self.connected and not self.connect():
+            return {"error": f"Not connected to {self.port}"}
+        
+        with self.lock:
+            try:
+                # Clear input buffer: read (at most 4 KiB) only to log what's discarded,
+                # then flush the rest so a flood of junk can't pose as this reply
+                if not self._buffer_clean and self.ser.in_waiting > 0:
+                    raw = self.ser.read(min(self.ser.in_waiting, 4096))
+                    self.ser.reset_input_buffer()
+                    # Only pay for the decode when the record will actually be logged
+                    if raw and self.logger.isEnabledFor(logging.INFO):
+                        cleared_data = raw.decode('utf-8', 'ignore').strip()
+                        if cleared_data:
+                            self.logger.info("CLEARED: %s", cleared_data)
+                
+                self.ser.write(_encode(cmd))
+                self.ser.flush()
+                self._buffer_clean = False
+                
+                # Log the sent command
+                self.logger.info("SEND: %s", cmd.strip())
+                
+                if predicate is None:
+                    return {"success": True}
+                
+                lines, matched = self._read_lines(predicate, timeout)
+                return {"lines": lines, "matched": matched}
                 
-                while time.time() < end_time:
-                    if self.ser.in_waiting > 0:
-                        line = self.ser.readline().decode('utf-8', 'ignore').strip()
-                        if line:
-                            # Log each received line
-                            self.log_message("RECV", line)
-                            response_lines.append(line)
-                            # Check if this line satisfies our predicate
-                            if predicate(line):
-                                self.log_message("MATCH", f"Predicate matched on: {line}")
-                                return {"success": True, "response": response_lines}
-                    else:
-                        time.sleep(0.01)  # Short sleep to avoid CPU spinning
-                        
-                # If we get here, the timeout expired without finding a match
-                if response_lines:
-                    self.log_message("ERROR", "Expected response not received within timeout")
-                    return {"error": "Expected response not received within timeout", "partial_response": response_lines}
-                else:
-                    self.log_message("ERROR", "No response from device within timeout")
-                    return {"error": "No response from device within timeout"}
-                    
             except serial.SerialException as e:
-                self.connected = False
-                error_msg = f"Serial error: {e}"
-                print(error_msg)
-                return {"error": error_msg}
+                return self._serial_error(e)
+    
+    def _read_lines(self, predicate: Callable[[str], bool], timeout: float):
+        """
+        Read lines until one satisfies predicate or timeout expires; caller holds self.lock.
+        Returns (lines, matched).
+        """
+        response_lines = []
+        buf = bytearray()
+        end_time = time.time() + timeout
+        
+        while (remaining := end_time - time.time()) > 0:
+            # Block in the kernel until data arrives or this slice of the budget runs out,
+            # then take everything already buffered in the same call
+            self.ser.timeout = min(remaining, 0.5)
+            chunk = self.ser.read(max(1, self.ser.in_waiting))
+            if not chunk:
+                # If we have at least one response and no data for a while, consider done
+                if response_lines and remaining < 0.5:
+                    break
+                continue
+            buf += chunk
+            # Handle every complete line; a trailing partial line waits for the next read
+            while (i := buf.find(b"\n")) != -1:
+                line = buf[:i].decode('utf-8', 'ignore').strip()
+                del buf[:i + 1]
+                if not line:
+                    continue
+                # Log the received response
+                self.logger.info("RECV: %s", line)
+                response_lines.append(line)
+                if predicate(line):
+                    self._buffer_clean = not buf
+                    return response_lines, True
+        
+        return response_lines, False
+    
+    def _predicate_result(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        """Shape a _send_and_wait result the way the predicate API reports it"""
+        if "lines" not in result:
+            return result
+        lines = result["lines"]
+        if result["matched"]:
+            self.logger.info("MATCH: Predicate matched on: %s", lines[-1])
+            return {"success": True, "response": lines}
+        # The timeout expired without finding a match
+        if lines:
+            self.logger.info("ERROR: Expected response not received within timeout")
+            return {"error": "Expected response not received within timeout", "partial_response": lines}
+        self.logger.info("ERROR: No response from device within timeout")
+        return {"error": "No response from device within timeout"}
+    
+    def _serial_error(self, e: serial.SerialException) -> Dict[str, Any]:
+        self.connected = False
+        self._buffer_clean = False
+        error_msg = f"Serial error: {e}"
+        print(error_msg)
+        return {"error": error_msg}
 
 # Initialize SerialManager
 serial_manager = SerialManager(SERIAL_PORT, BAUDRATE, TIMEOUT)
@@ -316,8 +348,8 @@ def dispense_hopper(denomination: int, count: int):
     if count <= 0:
         raise HTTPException(status_code=400, detail="Count must be positive")
 
-    serial_manager.send_command("RESET", wait_for_response=False)
-    time.sleep(1.0)  # Give the device time to reset
+    # The device acks with "OK RESET" once it has stopped the hoppers
+    serial_manager.send_command("RESET", timeout=2.0)
     
     command = f"HOPPER {denomination} {count}"
     result = serial_manager.send_command(command, wait_for_response=True, timeout=20.0)  # Longer timeout for dispensing
@@ -338,22 +370,17 @@ def calculate_change_breakdown(amount: int) -> Dict[int, int]:
     Returns:
         Dictionary with denomination as key and count as value
     """
-    result = {}
-    
-    # Start with largest denomination
-    denominations = [10, 5, 1]
-    remaining = amount
-    
-    for denom in denominations:
-        if remaining >= denom:
-            count = remaining // denom
-            result[denom] = count
-            remaining -= count * denom
-    
-    return result
+    # Denominations are fixed, so the greedy split is two divmods
+    tens, remaining = divmod(amount, 10)
+    fives, ones = divmod(remaining, 5)
+    return {denom: count for denom, count in ((10, tens), (5, fives), (1, ones)) if count}
+
+# Bit per hopper denomination, largest first (iteration order is the payout order)
+_DENOM_BIT = {10: 0b100, 5: 0b010, 1: 0b001}
+_ALL_DENOMS_MASK = 0b111
 
 @app.post("/change/{amount}")
-async def dispense_change(amount: int):
+def dispense_change(amount: int):
     """
     Calculate and dispense change using coin hoppers
     
@@ -373,29 +400,29 @@ async def dispense_change(amount: int):
     if amount <= 0:
         raise HTTPException(status_code=400, detail="Amount must be positive")
     
-    # Step 1: Reset the device to ensure clean state
-    serial_manager.send_command("RESET", wait_for_response=False)
-    time.sleep(1.0)  # Give the device time to reset
+    # Step 1: Reset the device to ensure clean state (acked with "OK RESET")
+    serial_manager.send_command("RESET", timeout=2.0)
     
     # Track how much we've successfully dispensed
     amount_dispensed = 0
     remaining_amount = amount
     all_responses = []
     
-    # Keep track of which denominations are available/working
-    available_denominations = [10, 5, 1]
+    # Keep track of which denominations are available/working (one bit each, see _DENOM_BIT)
+    available_mask = _ALL_DENOMS_MASK
     
     # Continue dispensing until there's nothing left or we've tried all options
-    while remaining_amount > 0 and available_denominations:
+    while remaining_amount > 0 and available_mask:
         # Calculate how many of each available coin we need
         coin_counts = {}
         temp_remaining = remaining_amount
         
-        for denom in sorted(available_denominations, reverse=True):
-            if temp_remaining >= denom:
-                count = temp_remaining // denom
-                coin_counts[denom] = count
-                temp_remaining -= count * denom
+        # Largest first; the fixed order replaces sorting the available list each round
+        for denom, bit in _DENOM_BIT.items():
+            if available_mask & bit:
+                count, temp_remaining = divmod(temp_remaining, denom)
+                if count:
+                    coin_counts[denom] = count
         
         # If we couldn't create any valid breakdown with available denominations, break
         if not coin_counts:
@@ -406,55 +433,49 @@ async def dispense_change(amount: int):
         dispensed_this_round = False
         
         # *** Keep track of which denominations have been tried in this round
-        tried_denominations = []
+        tried_mask = 0
+        for coin_value in coin_counts:
+            tried_mask |= _DENOM_BIT[coin_value]
         
-        for coin_value in sorted(coin_counts.keys(), reverse=True):
-            num_coins = coin_counts[coin_value]
+        # One batched command per round ("HOPPER 10 2 5 1 1 3"); the device pays the
+        # hoppers in turn, largest first, and reports "OUT <denom> ..." per coin
+        command = "HOPPER " + " ".join(f"{coin_value} {num_coins}" for coin_value, num_coins in coin_counts.items())
+        result = serial_manager.send_command(command, wait_for_response=True, timeout=10.0 * len(coin_counts))
+        
+        if "error" not in result and "response" in result:
+            responses = result.get("response", [])
+            all_responses.extend(responses)
             
-            if num_coins > 0:
-                command = f"HOPPER {coin_value} {num_coins}"
-                result = serial_manager.send_command(command, wait_for_response=True, timeout=10.0)
+            # coin_counts was filled largest first
+            for coin_value, num_coins in coin_counts.items():
+                # Count actual coins dispensed (the trailing space keeps "OUT 1" from matching "OUT 10")
+                out_prefix = f"OUT {coin_value} "
+                coins_dispensed = sum(1 for line in responses if line.startswith(out_prefix))
                 
-                # Add this denomination to tried list
-                tried_denominations.append(coin_value)
+                # Update amounts
+                amount_dispensed += coins_dispensed * coin_value
+                remaining_amount -= coins_dispensed * coin_value
                 
-                coins_dispensed = 0
-                if "error" not in result and "response" in result:
-                    responses = result.get("response", [])
-                    all_responses.extend(responses)
-                    
-                    # Count actual coins dispensed
-                    for line in responses:
-                        if f"OUT {coin_value}" in line:
-                            coins_dispensed += 1
-                    
-                    # Update amounts
-                    amount_dispensed += coins_dispensed * coin_value
-                    remaining_amount -= coins_dispensed * coin_value
-                    
-                    if coins_dispensed > 0:
-                        dispensed_this_round = True
-                    
-                    # If we dispensed fewer coins than requested, this denomination may be empty/faulty
-                    if coins_dispensed < num_coins:
-                        all_responses.append(f"Warning: Only dispensed {coins_dispensed}/{num_coins} coins of {coin_value}₱")
-                        if coins_dispensed == 0:
-                            # Remove this denomination from available options
-                            all_responses.append(f"Removing {coin_value}₱ from available denominations")
-                            available_denominations.remove(coin_value)
-                else:
-                    error_msg = f"Error dispensing {num_coins} x {coin_value}₱ coins: {result.get('error', 'Unknown error')}"
-                    all_responses.append(error_msg)
-                    # Remove this denomination from available options
-                    all_responses.append(f"Removing {coin_value}₱ from available denominations")
-                    if coin_value in available_denominations:
-                        available_denominations.remove(coin_value)
+                if coins_dispensed > 0:
+                    dispensed_this_round = True
                 
-                time.sleep(1.0)  # Wait before next dispense operation
+                # If we dispensed fewer coins than requested, this denomination may be empty/faulty
+                if coins_dispensed < num_coins:
+                    all_responses.append(f"Warning: Only dispensed {coins_dispensed}/{num_coins} coins of {coin_value}₱")
+                    if coins_dispensed == 0:
+                        # Remove this denomination from available options
+                        all_responses.append(f"Removing {coin_value}₱ from available denominations")
+                        available_mask &= ~_DENOM_BIT[coin_value]
+        else:
+            all_responses.append(f"Error dispensing '{command}': {result.get('error', 'Unknown error')}")
+            for coin_value in coin_counts:
+                # Remove this denomination from available options
+                all_responses.append(f"Removing {coin_value}₱ from available denominations")
+                available_mask &= ~_DENOM_BIT[coin_value]
         
         # *** Change this check to verify if we've tried all available denominations
         # If we tried all available denominations but couldn't dispense anything, we're stuck
-        if not dispensed_this_round and set(tried_denominations) == set(available_denominations):
+        if not dispensed_this_round and tried_mask == available_mask:
             all_responses.append(f"Failed to dispense any coins for remaining {remaining_amount}₱")
             break
     
@@ -478,6 +499,9 @@ async def dispense_change(amount: int):
         "responses": all_responses
     }
 
+# Acknowledgement the device sends for each COINSLOT action
+_COINSLOT_OK = {"ON": "OK COINSLOT ENABLED", "OFF": "OK COINSLOT DISABLED"}
+
 @app.get("/paper/{paper_type}")
 def check_paper(paper_type: str):
     """
@@ -504,10 +528,9 @@ def check_paper(paper_type: str):
     # Look for the 1 or 0 response
     has_paper = None
     for line in responses:
-        if line == "1":
-            has_paper = True
-        elif line == "0":
-            has_paper = False
+        if line == "1" or line == "0":
+            has_paper = line == "1"
+            break
     
     return {
         "paper_type": paper_type,
@@ -572,7 +595,7 @@ def control_coinslot(action: str):
         Success message or error
     """
     action = action.upper()
-    if action not in ["ON", "OFF"]:
+    if action not in _COINSLOT_OK:
         raise HTTPException(status_code=400, detail="Action must be 'on' or 'off'")
     
     command = f"COINSLOT {action}"
@@ -584,7 +607,7 @@ def control_coinslot(action: str):
     responses = result.get("response", [])
     
     # Check for the expected response
-    expected_response = f"OK COINSLOT {'ENABLED' if action == 'ON' else 'DISABLED'}"
+    expected_response = _COINSLOT_OK[action]
     success = any(expected_response in line for line in responses)
     
     return {
@@ -594,6 +617,25 @@ def control_coinslot(action: str):
         "responses": responses
     }
 
+def _tail(path: str, n: int, chunk_size: int = 8192) -> List[str]:
+    """
+    Return the last n lines of a file (with line endings, like readlines()),
+    reading backwards from the end so the cost does not grow with the file
+    """
+    if n <= 0:
+        return []
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        buf = bytearray()
+        # n+1 newlines guarantee n complete lines (the last line ends in one)
+        while pos > 0 and buf.count(b"\n") <= n:
+            step = min(chunk_size, pos)
+            pos -= step
+            f.seek(pos)
+            buf[:0] = f.read(step)
+    return [line.decode("utf-8", "replace") for line in buf.splitlines(keepends=True)[-n:]]
+
 @app.get("/logs")
 def get_logs(lines: int = 50):
     """Get the most recent serial communication logs
@@ -602,11 +644,7 @@ def get_logs(lines: int = 50):
         lines: Number of most recent lines to fetch (default: 50)
     """
     try:
-        with open(serial_manager.log_file, "r") as f:
-            all_lines = f.readlines()
-            # Get the last N lines
-            recent_lines = all_lines[-lines:] if len(all_lines) > lines else all_lines
-            return {"logs": recent_lines}
+        return {"logs": _tail(serial_manager.log_file, lines)}
     except Exception as e:
         return {"error": f"Error reading log file: {e}"}
 
@@ -616,12 +654,19 @@ def health_check():
     serial_status = "connected" if serial_manager.connected else "disconnected"
     
     if serial_manager.connected:
-        # Try to get status from Arduino
-        status_cmd = serial_manager.send_command("STATUS?")
-        if "error" not in status_cmd and "response" in status_cmd:
-            arduino_status = status_cmd["response"][0]
+        # Reuse a fresh reply so frequent health polls don't compete for the port
+        now = time.monotonic()
+        ts, cached = serial_manager._status_cache
+        if cached is not None and now - ts < HEALTH_STATUS_TTL:
+            arduino_status = cached
         else:
-            arduino_status = "unknown"
+            # Try to get status from Arduino
+            status_cmd = serial_manager.send_command("STATUS?")
+            if "error" not in status_cmd and "response" in status_cmd:
+                arduino_status = status_cmd["response"][0]
+                serial_manager._status_cache = (now, arduino_status)
+            else:
+                arduino_status = "unknown"
     else:
         arduino_status = "disconnected"
     
@@ -636,9 +681,10 @@ def health_check():
 @app.on_event("startup")
 async def startup_event():
     """Initialize components on startup"""
-    # Ensure serial connection is established
+    to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+    # Ensure serial connection is established (off the event loop: open + settle sleeps block)
     if not serial_manager.connected:
-        serial_manager.connect()
+        await run_in_threadpool(serial_manager.connect)
 
 @app.on_event("shutdown")
 async def shutdown_event():
@@ -646,4 +692,6 @@ async def shutdown_event():
     serial_manager.close()
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # One worker: there is a single serial port, and a second process would fight over it.
+    # Blocking endpoints already run in the threadpool, so uvloop/httptools speed up the rest.
+    uvicorn.run(app, host="0.0.0.0", port=8000, loop="uvloop", http="httptools", workers=1)
\ No newline at end of file
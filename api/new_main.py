@@ -1,10 +1,9 @@
-import time
-import threading
-import serial
-from typing import Optional, List, Dict, Any
+from serial_manager import AsyncSerialManager, CMD_STATUS, CMD_COINS
 
-from fastapi import FastAPI, HTTPException
-from fastapi.middleware.cors import CORSMiddleware
+from anyio import to_thread
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import ORJSONResponse
+import orjson
 import uvicorn
 
 # Serial port configuration
@@ -12,138 +11,60 @@ SERIAL_PORT = '/dev/ttyACM0'  # Default Arduino port on Raspberry Pi
 BAUDRATE = 9600  # As specified in cmd.txt
 TIMEOUT = 1.0
 
-# Initialize FastAPI
-app = FastAPI(title="Bondpaper Machine API", version="1.0")
+# Most in-flight HTTP requests before uvicorn answers 503
+LIMIT_CONCURRENCY = 32
+# anyio worker threads for sync handlers (default 40)
+THREADPOOL_SIZE = 4
 
-# Configure CORS
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# Initialize FastAPI (routes return plain dicts of scalars; orjson encodes them in C)
+app = FastAPI(title="Bondpaper Machine API", version="1.0", default_response_class=ORJSONResponse)
 
-# Serial connection manager
-class SerialManager:
-    def __init__(self, port: str, baud: int, timeout: float = 1.0):
-        self.port = port
-        self.baud = baud
-        self.timeout = timeout
-        self.ser = None
-        self.lock = threading.Lock()
-        self.connected = False
-        self.last_error = None
-        self.connect()
-    
-    def connect(self) -> bool:
-        with self.lock:
-            try:
-                # Close if already open
-                if self.ser and self.ser.is_open:
-                    self.ser.close()
-                    time.sleep(0.3)
-                
-                # Create new connection
-                self.ser = serial.Serial(
-                    port=self.port,
-                    baudrate=self.baud,
-                    timeout=self.timeout
-                )
-                time.sleep(0.5)  # Give Arduino time to initialize
-                
-                # Send a newline to reset Arduino buffer
-                self.ser.write(b"\n")
-                self.ser.flush()
-                
-                self.connected = True
-                self.last_error = None
-                return True
-            
-            except Exception as e:
-                self.last_error = f"Serial connection error: {e}"
-                print(self.last_error)
-                self.connected = False
-                return False
-    
-    def send_command(self, cmd: str, wait_for_response: bool = True, timeout: float = 2.0) -> Dict[str, Any]:
-        """
-        Send a command to Arduino and optionally wait for response
-        
-        Args:
-            cmd: Command to send
-            wait_for_response: Whether to wait for a response
-            timeout: How long to wait for complete response
-            
-        Returns:
-            Dictionary with response lines or error
-        """
-        if not self.connected and not self.connect():
-            return {"error": f"Not connected to {self.port}"}
-        
-        with self.lock:
-            try:
-                # Clear input buffer
-                if self.ser.in_waiting > 0:
-                    self.ser.read(self.ser.in_waiting)
-                
-                # Send command with newline if needed
-                if not cmd.endswith('\n'):
-                    cmd += '\n'
-                self.ser.write(cmd.encode('utf-8'))
-                self.ser.flush()
-                
-                if not wait_for_response:
-                    return {"success": True}
-                
-                # Read response with timeout
-                response_lines = []
-                end_time = time.time() + timeout
-                
-                while time.time() < end_time:
-                    if self.ser.in_waiting > 0:
-                        line = self.ser.readline().decode('utf-8', 'ignore').strip()
-                        if line:
-                            response_lines.append(line)
-                            # If we got an error response, we can stop reading
-                            if line.startswith("ERR"):
-                                break
-                            # For commands that return a specific value and don't need more lines
-                            if cmd.strip() in ["COINS?", "STATUS?"] and not line.startswith("ERR"):
-                                break
-                    else:
-                        time.sleep(0.01)  # Short sleep to avoid CPU spinning
-                        # If we have at least one response and no data for a while, consider done
-                        if response_lines and (time.time() - end_time) > -0.5:
-                            break
-                
-                # Process response
-                if not response_lines:
-                    return {"error": "No response from device"}
-                
-                # Return all response lines
-                return {"response": response_lines}
-                
-            except serial.SerialException as e:
-                self.connected = False
-                error_msg = f"Serial error: {e}"
-                print(error_msg)
-                return {"error": error_msg}
-    
-    def close(self) -> None:
-        with self.lock:
-            if self.ser and self.ser.is_open:
-                self.ser.close()
-                self.connected = False
+# Configure CORS: the kiosk UI is the only client, so every origin is allowed and the
+# header is constant; this replaces CORSMiddleware's per-request origin/header checks
+_CORS_HEADERS = [(b"access-control-allow-origin", b"*")]
+
+class AllowAllOrigins:
+    """ASGI middleware that adds the allow-origin header to every HTTP response"""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        async def send_with_cors(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + _CORS_HEADERS
+            await send(message)
+
+        await self.app(scope, receive, send_with_cors)
+
+app.add_middleware(AllowAllOrigins)
+
+@app.options("/{path:path}")
+async def cors_preflight(path: str, request: Request):
+    """Answer CORS preflights for every route (the middleware adds the origin header)"""
+    return Response(status_code=204, headers={
+        "access-control-allow-methods": "GET, POST, OPTIONS",
+        "access-control-allow-headers": request.headers.get("access-control-request-headers", "*"),
+        "access-control-max-age": "600",
+    })
+
+# Fixed commands, pre-encoded once (STATUS?/COINS?/STOP come from serial_manager)
+CMD_COINS_RESET = b"COINS=RST\n"
+
+_HOPPER_DENOMS = frozenset((1, 5, 10))
+# Paper type -> command template; doubles as the set of valid types
+_PAPER_CMD = {"SHORT": b"PAPER SHORT %d\n", "LONG": b"PAPER LONG %d\n"}
 
 # Initialize SerialManager
-serial_manager = SerialManager(SERIAL_PORT, BAUDRATE, TIMEOUT)
+serial_manager = AsyncSerialManager(SERIAL_PORT, BAUDRATE, TIMEOUT)
 
 # API Routes
 @app.get("/status")
-def get_status():
+async def get_status():
     """Get system status"""
-    result = serial_manager.send_command("STATUS?")
+    result = await serial_manager.send_command(CMD_STATUS)
     
     if "error" in result:
         return {"error": result["error"]}
@@ -152,9 +73,9 @@ def get_status():
     return {"status": result.get("response", [""])[0]}
 
 @app.get("/coins")
-def get_coin_count():
+async def get_coin_count():
     """Get current inserted coins"""
-    result = serial_manager.send_command("COINS?")
+    result = await serial_manager.send_command(CMD_COINS)
     
     if "error" in result:
         return {"error": result["error"]}
@@ -167,9 +88,9 @@ def get_coin_count():
         return {"error": "Invalid response", "raw": result.get("response", [])}
 
 @app.post("/coins/reset")
-def reset_coin_count():
+async def reset_coin_count():
     """Reset coin counter to zero"""
-    result = serial_manager.send_command("COINS=RST", wait_for_response=False)
+    result = await serial_manager.send_command(CMD_COINS_RESET, wait_for_response=False)
     
     if "error" in result:
         return {"error": result["error"]}
@@ -177,7 +98,7 @@ def reset_coin_count():
     return {"success": True, "message": "Coin counter reset"}
 
 @app.post("/hopper/{denomination}/{count}")
-def dispense_hopper(denomination: int, count: int):
+async def dispense_hopper(denomination: int, count: int):
     """
     Dispense specific coins from hopper
     
@@ -185,14 +106,14 @@ def dispense_hopper(denomination: int, count: int):
         denomination: Coin value (1, 5, or 10)
         count: Number of coins to dispense
     """
-    if denomination not in [1, 5, 10]:
+    if denomination not in _HOPPER_DENOMS:
         raise HTTPException(status_code=400, detail="Denomination must be 1, 5, or 10")
     
     if count <= 0:
         raise HTTPException(status_code=400, detail="Count must be positive")
     
-    command = f"HOPPER {denomination} {count}"
-    result = serial_manager.send_command(command, timeout=5.0)  # Longer timeout for dispensing
+    command = b"HOPPER %d %d\n" % (denomination, count)
+    result = await serial_manager.send_command(command, timeout=5.0)  # Longer timeout for dispensing
     
     if "error" in result:
         return {"error": result["error"]}
@@ -201,7 +122,7 @@ def dispense_hopper(denomination: int, count: int):
     return {"response": result.get("response", [])}
 
 @app.post("/change/{amount}")
-def dispense_change(amount: int):
+async def dispense_change(amount: int):
     """
     Automatically calculate and dispense change
     
@@ -211,8 +132,8 @@ def dispense_change(amount: int):
     if amount <= 0:
         raise HTTPException(status_code=400, detail="Amount must be positive")
     
-    command = f"CHANGE {amount}"
-    result = serial_manager.send_command(command, timeout=10.0)  # Longer timeout for change dispensing
+    command = b"CHANGE %d\n" % amount
+    result = await serial_manager.send_command(command, timeout=10.0)  # Longer timeout for change dispensing
     
     if "error" in result:
         return {"error": result["error"]}
@@ -221,7 +142,7 @@ def dispense_change(amount: int):
     return {"response": result.get("response", [])}
 
 @app.post("/paper/{paper_type}/{count}")
-def dispense_paper(paper_type: str, count: int):
+async def dispense_paper(paper_type: str, count: int):
     """
     Dispense paper sheets
     
@@ -230,14 +151,15 @@ def dispense_paper(paper_type: str, count: int):
         count: Number of sheets to dispense
     """
     paper_type = paper_type.upper()
-    if paper_type not in ["SHORT", "LONG"]:
+    template = _PAPER_CMD.get(paper_type)
+    if template is None:
         raise HTTPException(status_code=400, detail="Paper type must be SHORT or LONG")
     
     if count <= 0:
         raise HTTPException(status_code=400, detail="Count must be positive")
     
-    command = f"PAPER {paper_type} {count}"
-    result = serial_manager.send_command(command, wait_for_response=True, timeout=5.0)
+    command = template % count
+    result = await serial_manager.send_command(command, wait_for_response=True, timeout=5.0)
     
     if "error" in result:
         return {"error": result["error"]}
@@ -246,49 +168,72 @@ def dispense_paper(paper_type: str, count: int):
     return {"success": True, "message": f"Dispensed {count} sheets of {paper_type} paper"}
 
 @app.post("/stop")
-def emergency_stop():
+async def emergency_stop():
     """Emergency stop for all hopper operations"""
-    result = serial_manager.send_command("STOP", wait_for_response=False)
+    # Out of band while a HOPPER/CHANGE is paying out, so it doesn't queue behind it
+    result = await serial_manager.emergency_stop()
     
     if "error" in result:
         return {"error": result["error"]}
     
     return {"success": True, "message": "Emergency stop sent"}
 
+# (arduino status, encoded body) of the last healthy /health reply
+_health_body = (None, b"")
+# Health must always reflect the live state, never a cached copy
+_HEALTH_HEADERS = {"cache-control": "no-store"}
+
 @app.get("/health")
-def health_check():
+async def health_check():
     """API health check endpoint"""
+    global _health_body
     serial_status = "connected" if serial_manager.connected else "disconnected"
     
     if serial_manager.connected:
-        # Try to get status from Arduino
-        status_cmd = serial_manager.send_command("STATUS?")
-        if "error" not in status_cmd and "response" in status_cmd:
-            arduino_status = status_cmd["response"][0]
-        else:
-            arduino_status = "unknown"
+        # Try to get status from Arduino (cached, so health polls don't compete for the port)
+        arduino_status = await serial_manager.get_status_cached() or "unknown"
     else:
         arduino_status = "disconnected"
     
-    return {
+    if serial_manager.connected and serial_manager.last_error is None:
+        # Common case: the body only changes with the Arduino status, so reuse the bytes
+        cached_status, body = _health_body
+        if cached_status != arduino_status:
+            body = orjson.dumps({
+                "status": "online",
+                "serial": serial_status,
+                "arduino": arduino_status,
+                "error": None
+            })
+            _health_body = (arduino_status, body)
+        return Response(content=body, media_type="application/json", headers=_HEALTH_HEADERS)
+    
+    return ORJSONResponse({
         "status": "online",
         "serial": serial_status,
         "arduino": arduino_status,
         "error": serial_manager.last_error
-    }
+    }, headers=_HEALTH_HEADERS)
 
 # Application startup and shutdown events
 @app.on_event("startup")
 async def startup_event():
     """Initialize components on startup"""
+    # Routes are async and never need the threadpool for serial I/O; keep it small so
+    # a sync route or dependency added later can't park dozens of threads on the port
+    to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
     # Ensure serial connection is established
     if not serial_manager.connected:
-        serial_manager.connect()
+        await serial_manager.connect()
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Clean up resources on shutdown"""
-    serial_manager.close()
+    await serial_manager.close()
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # One worker: there is a single serial port, and a second process would fight over it
+    # (don't raise this via WEB_CONCURRENCY). limit_concurrency sheds bursts with 503s
+    # before they pile up in the serial pump's queue.
+    uvicorn.run(app, host="0.0.0.0", port=8000, loop="uvloop", http="httptools", workers=1,
+                limit_concurrency=LIMIT_CONCURRENCY)
\ No newline at end of file
@@ -1,8 +1,75 @@
+import os
 import time
+import errno
+import fcntl
+import termios
 import json
+import random
+import struct
+import selectors
+import asyncio
 import threading
 import serial
-from typing import Dict, Any, Optional, Callable
+from collections import defaultdict, deque
+import serial_asyncio_fast
+from typing import Dict, Any, List, Optional, Callable, Union
+from line_protocol import terminator_for_bytes, LINE_STOPPED
+
+CONNECT_READY_TIMEOUT = 0.8  # Longest connect() waits for the board to answer
+# Auto-reconnect waits 1, 2, 4, 8, 16, 16, ... s between attempts, each +/-20%
+RECONNECT_MIN_DELAY = 1.0
+RECONNECT_MAX_DELAY = 16.0
+RECONNECT_JITTER = 0.2
+
+def _claim_port(fd: int) -> None:
+    """Set TIOCEXCL on an open tty, so other processes' open() fails with EBUSY
+    instead of the two of us splitting (and garbling) the Arduino's replies"""
+    fcntl.ioctl(fd, termios.TIOCEXCL)
+
+def _describe_open_error(port: str, e: Exception) -> str:
+    """Say whether an open failed because the port is missing or held by someone else"""
+    code = e.args[0] if e.args and isinstance(e.args[0], int) else getattr(e, "errno", None)
+    if code in (errno.EBUSY, errno.EAGAIN):
+        return f"{port} is busy (in use by another process): {e}"
+    if code in (errno.ENOENT, errno.ENODEV, errno.ENXIO):
+        return f"{port} not present (is the Arduino plugged in?): {e}"
+    return str(e)
+
+# Framed messages from the src/main firmware (see SerialComm::sendMessage):
+# STX, 2-byte little-endian body length, then the JSON body
+FRAME_STX = b"\x02"
+# Legacy "status" command; any running board answers it with a status frame
+CMD_PING = b"\nstatus\n"
+_FRAME_LEN = struct.Struct("<H")
+
+def take_frame(buf: bytearray) -> Optional[bytes]:
+    """
+    Remove the first complete frame from buf and return its body.
+    Bytes ahead of STX (e.g. noise after a reset) are dropped; returns None,
+    leaving the partial frame in buf, until the whole frame has arrived.
+    """
+    start = buf.find(FRAME_STX)
+    if start == -1:
+        buf.clear()
+        return None
+    del buf[:start]
+    if len(buf) < 1 + _FRAME_LEN.size:
+        return None
+    (n,) = _FRAME_LEN.unpack_from(buf, 1)
+    end = 1 + _FRAME_LEN.size + n
+    if len(buf) < end:
+        return None
+    body = bytes(buf[1 + _FRAME_LEN.size:end])
+    del buf[:end]
+    return body
+
+def _reconnect_delays():
+    """Exponential backoff with jitter, so an unplugged board isn't probed (and the
+    port lock taken) at a fixed rate, and several processes don't retry in lockstep"""
+    delay = RECONNECT_MIN_DELAY
+    while True:
+        yield delay * random.uniform(1 - RECONNECT_JITTER, 1 + RECONNECT_JITTER)
+        delay = min(delay * 2, RECONNECT_MAX_DELAY)
 
 class SerialManager:
     def __init__(self, port: str, baud: int, timeout: float = 1.0, max_retries: int = 3):
@@ -15,9 +82,12 @@ class SerialManager:
         self.status_callbacks = []
         self.last_error = None
         self.connected = False
-        # Initialize the connection
+        # The port is opened by connect() (call it once at app startup), not here,
+        # so importing the app never touches the device
         self._auto_reconnect_thread = None
-        self.connect()
+        # Readiness selector for the open port's fd, registered once per connection
+        self._sel: Optional[selectors.BaseSelector] = None
+        self._fd: Optional[int] = None
         
     def register_status_callback(self, callback: Callable[[bool, Optional[str]], None]) -> None:
         """Register a callback for connection status changes"""
@@ -36,55 +106,87 @@ class SerialManager:
     def connect(self) -> bool:
         """Establish serial connection with retry logic"""
         with self.lock:
-            try:
-                # Close if already open
-                if self.ser and self.ser.is_open:
-                    self.ser.close()
-                    time.sleep(0.3)  # Reduced delay for better responsiveness
-                    
-                # Create new connection
-                self.ser = serial.Serial(
-                    port=self.port,
-                    baudrate=self.baud, 
-                    timeout=self.timeout,
-                    write_timeout=1.0,  # Add write timeout
-                    inter_byte_timeout=0.1  # Improve responsiveness
-                )
-                time.sleep(0.5)  # Reduced delay for better responsiveness
-                
-                # Send a test command to verify connection
-                self.ser.write(b"\n")
-                self.ser.flush()
-                
-                self._notify_status(True)
+            # Someone else (e.g. the auto-reconnect thread) may have reconnected while we
+            # waited for the lock; reopening would reset the board again
+            if self.connected:
                 return True
+            return self._connect_locked()
+
+    def _connect_locked(self) -> bool:
+        """connect() for callers that already hold self.lock (it is not reentrant)"""
+        try:
+            # Close if already open
+            self._close_selector()
+            if self.ser and self.ser.is_open:
+                self.ser.close()
                 
-            except Exception as e:
-                error_msg = f"Serial connection error: {e}"
-                print(error_msg)
-                self._notify_status(False, error_msg)
-                
-                # Start auto-reconnect if not already running
-                if not self._auto_reconnect_thread or not self._auto_reconnect_thread.is_alive():
-                    self._auto_reconnect_thread = threading.Thread(
-                        target=self._auto_reconnect, daemon=True)
-                    self._auto_reconnect_thread.start()
-                    
-                return False
+            # Create new connection. pyserial opens the tty O_NONBLOCK, so a missing or
+            # busy port fails here at once; exclusive=True flock()s it and TIOCEXCL
+            # keeps other openers out entirely
+            self.ser = serial.Serial(
+                port=self.port,
+                baudrate=self.baud, 
+                timeout=self.timeout,
+                write_timeout=1.0,  # Add write timeout
+                inter_byte_timeout=0.1,  # Improve responsiveness
+                exclusive=True
+            )
+            _claim_port(self.ser.fileno())
+            # Ask the tty driver to hand over bytes immediately (TIOCSSERIAL
+            # ASYNC_LOW_LATENCY) instead of coalescing them for up to 16 ms
+            try:
+                self.ser.set_low_latency_mode(True)
+            except (AttributeError, ValueError) as e:
+                # Not supported on this platform/driver; keep default latency
+                print(f"Low-latency mode unavailable on {self.port}: {e}")
+            self._fd = self.ser.fileno()
+            self._sel = selectors.DefaultSelector()
+            self._sel.register(self._fd, selectors.EVENT_READ)
+            
+            # Ping with a command the firmware answers (the leading newline ends any
+            # partial line; empty lines are ignored) and return on the first frame back:
+            # the status reply from a running board, or the boot frame from one that
+            # the open just reset. send_command flushes whatever else arrives.
+            self.ser.write(CMD_PING)
+            self.ser.flush()
+            self.read_frame(CONNECT_READY_TIMEOUT)
+            
+            self._notify_status(True)
+            return True
+            
+        except Exception as e:
+            error_msg = f"Serial connection error: {_describe_open_error(self.port, e)}"
+            print(error_msg)
+            self._notify_status(False, error_msg)
+            
+            # Start auto-reconnect if not already running
+            if not self._auto_reconnect_thread or not self._auto_reconnect_thread.is_alive():
+                self._auto_reconnect_thread = threading.Thread(
+                    target=self._auto_reconnect, daemon=True)
+                self._auto_reconnect_thread.start()
                 
+            return False
+            
     def _auto_reconnect(self) -> None:
-        """Background thread that attempts to reconnect periodically"""
-        retry_delay = 5.0
-        while not self.connected:
+        """Background thread that attempts to reconnect, backing off between tries"""
+        for retry_delay in _reconnect_delays():
+            if self.connected:
+                break
             time.sleep(retry_delay)
             print(f"Attempting auto-reconnect to {self.port}...")
             if self.connect():
                 print("Auto-reconnect successful!")
                 break
     
-    def send_command(self, cmd: str, expect_json: bool = False, 
+    def send_command(self, cmd: Union[str, bytes], expect_json: bool = False, 
                     timeout: float = 2.5) -> Dict[str, Any]:
-        """Send command with exclusive access and error handling"""
+        """Send command with exclusive access and error handling.
+        Pass prebuilt newline-terminated bytes to skip the per-call encode."""
+        if isinstance(cmd, str):
+            if not cmd.endswith("\n"):
+                cmd += "\n"
+            cmd = cmd.encode("utf-8")
+
         # Fast fail if not connected
         if not self.connected and not self.connect():
             return {"error": f"Not connected to {self.port}", "status": "disconnected"}
@@ -94,44 +196,20 @@ class SerialManager:
             
             while retry_count < self.max_retries:
                 try:
-                    # Clear input buffer for clean response
-                    if self.ser and self.ser.in_waiting > 0:
-                        self.ser.read(self.ser.in_waiting)
+                    # Clear input buffer for clean response: one tcflush, no TIOCINQ poll + read
+                    self.ser.reset_input_buffer()
                     
-                    # Send command with newline if needed
-                    if not cmd.endswith("\n"):
-                        cmd += "\n"
-                    self.ser.write(cmd.encode("utf-8"))
+                    self.ser.write(cmd)
                     self.ser.flush()
                     
-                    # Wait a tiny bit for device to process command
-                    time.sleep(0.05)  # Minimal delay for responsiveness
-                    
-                    # Read response with dynamic timeout
-                    response_lines = []
-                    end_time = time.time() + timeout
-                    
-                    while time.time() < end_time:
-                        # Check if data available to avoid blocking
-                        if self.ser.in_waiting > 0:
-                            line = self.ser.readline().decode("utf-8", "ignore").strip()
-                            if line:
-                                response_lines.append(line)
-                                # Stop if we see JSON end marker or complete message
-                                if (expect_json and line.endswith("}")) or line == "END":
-                                    break
-                        else:
-                            # Small sleep to avoid CPU spinning while waiting for more data
-                            time.sleep(0.01)
-                            # If we've waited a bit with no data, consider response complete
-                            if response_lines and (time.time() - end_time) > -0.5:
-                                break
+                    # The reply is one frame; it ends exactly where its length says
+                    body = self.read_frame(timeout)
                     
                     # Process response
-                    response = "\n".join(response_lines)
+                    response = body.decode("utf-8", "ignore") if body else ""
                     if not response:
                         retry_count += 1
-                        print(f"No response to '{cmd.strip()}', retrying {retry_count}/{self.max_retries}")
+                        print(f"No response to '{cmd.decode().strip()}', retrying {retry_count}/{self.max_retries}")
                         time.sleep(0.2 * retry_count)  # Progressive backoff
                         continue
                         
@@ -140,12 +218,6 @@ class SerialManager:
                         try:
                             return json.loads(response)
                         except json.JSONDecodeError:
-                            # Try to fix incomplete JSON responses by adding closing brace
-                            if response.count('{') > response.count('}'):
-                                try:
-                                    return json.loads(response + "}")
-                                except:
-                                    pass
                             return {"raw": response, "error": "Invalid JSON response"}
                     else:
                         return {"raw": response}
@@ -155,7 +227,7 @@ class SerialManager:
                     print(error_msg)
                     self._notify_status(False, error_msg)
                     retry_count += 1
-                    self.connect()  # Try to reconnect
+                    self._connect_locked()  # Try to reconnect; we already hold the lock
                     time.sleep(0.5 * retry_count)  # Progressive backoff
             
             # If we get here, all retries failed
@@ -163,9 +235,512 @@ class SerialManager:
             self._notify_status(False, error_msg)
             return {"error": error_msg, "status": "failed"}
 
+    def read_frame(self, timeout: float) -> Optional[bytes]:
+        """
+        Read one framed message and return its body, or None if no whole frame
+        arrives within timeout. Doesn't take self.lock: callers serialize access
+        to the port themselves. Anything after the frame is left unread by the caller
+        (the next command clears the input buffer first).
+        """
+        buf = bytearray()
+        end_time = time.monotonic() + timeout
+        while (body := take_frame(buf)) is None:
+            chunk = self._read_chunk(end_time - time.monotonic())
+            if not chunk:
+                return None
+            buf += chunk
+        return body
+
+    def _read_chunk(self, timeout: float) -> bytes:
+        """Sleep in the selector until the port is readable, then read what's there.
+        Returns b"" on timeout."""
+        if timeout <= 0:
+            return b""
+        if not self._sel.select(timeout):
+            return b""
+        try:
+            data = os.read(self._fd, 4096)
+        except OSError as e:
+            raise serial.SerialException(f"read failed: {e}")
+        if not data:
+            # Readable but empty means the device went away (e.g. unplugged)
+            raise serial.SerialException("device reports readiness to read but returned no data")
+        return data
+
+    def _close_selector(self) -> None:
+        if self._sel is not None:
+            self._sel.close()
+            self._sel = None
+            self._fd = None
+
     def close(self) -> None:
         """Close the serial connection safely"""
         with self.lock:
+            self._close_selector()
             if self.ser and self.ser.is_open:
                 self.ser.close()
-                self._notify_status(False, "Connection closed")
\ No newline at end of file
+                self._notify_status(False, "Connection closed")
+
+# ---------- Line protocol (src/main-final) ----------
+
+CMD_STATUS = b"STATUS?\n"
+CMD_COINS = b"COINS?\n"
+CMD_STOP = b"STOP\n"
+# The firmware's stop_all_change() takes ~650 ms before it prints "OK STOPPED"
+STOP_TIMEOUT = 2.0
+# Replies a STOP can cut short (see _latency_key for the keys)
+_STOPPABLE = frozenset((b"HOPPER", b"HOPPER+", b"CHANGE"))
+
+# Commands whose reply is exactly one line
+_SINGLE_LINE = frozenset((CMD_STATUS, CMD_COINS))
+# Single-line, side-effect-free queries the pump may write back to back
+_BATCHABLE = _SINGLE_LINE
+PUMP_BATCH = 4
+# Side-effect-free queries whose concurrent duplicates share one exchange
+_COALESCE = _SINGLE_LINE
+
+# Multi-line replies are read until this long before the deadline
+REPLY_SETTLE = 0.5
+# Adaptive reply timeouts: once a command has ADAPT_MIN_SAMPLES complete replies,
+# wait ADAPT_MARGIN x its p99 reply time (per unit of work) instead of the caller's
+# fixed timeout, which stays the upper bound (and the fallback when the estimate misses)
+LATENCY_WINDOW = 64
+ADAPT_MIN_SAMPLES = 8
+ADAPT_MARGIN = 1.5
+ADAPT_FLOOR = 0.1
+ADAPT_MISS_WIDEN = 2.0
+
+def _latency_key(cmd: bytes):
+    """
+    (key, units of work) for latency tracking: reply time grows with the coins paid
+    out by HOPPER/CHANGE and the sheets in PAPER, so samples are kept per unit.
+    Batched HOPPER runs several hoppers in turn and is tracked apart from single HOPPER.
+    """
+    parts = cmd.split()
+    key = parts[0] if parts else cmd
+    try:
+        if key == b"HOPPER":
+            units = sum(int(n) for n in parts[2::2])  # HOPPER <d> <n> [<d> <n> ...]
+            if len(parts) > 3:
+                key = b"HOPPER+"
+        elif key == b"CHANGE":
+            # Coins, not pesos: CHANGE 10 is one coin, CHANGE 4 is four
+            n10, rest = divmod(int(parts[1]), 10)
+            n5, n1 = divmod(rest, 5)
+            units = n10 + n5 + n1
+        elif key == b"PAPER":
+            units = int(parts[2])
+        else:
+            units = 1
+    except (IndexError, ValueError):
+        units = 1
+    return key, max(units, 1)
+
+def _wire(cmd: str) -> bytes:
+    """Newline-terminated UTF-8 bytes for a str command"""
+    return (cmd if cmd.endswith('\n') else cmd + '\n').encode('utf-8')
+
+class AsyncSerialManager:
+    """
+    Line-protocol (main-final) counterpart of SerialManager for asyncio apps.
+    Owns the Arduino port on the event loop: a reader task queues every line the
+    device sends, and commands wait on that queue instead of blocking a thread
+    """
+    def __init__(self, port: str, baud: int, timeout: float = 1.0):
+        self.port = port
+        self.baud = baud
+        self.timeout = timeout
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.lock = asyncio.Lock()
+        self.connected = False
+        self.last_error = None
+        # Lines received from the device (stripped bytes), filled by _read_loop()
+        self._lines: asyncio.Queue = asyncio.Queue()
+        # Receive buffer the lines are split out of; one per connection
+        self._rxbuf = bytearray()
+        self._read_task: Optional[asyncio.Task] = None
+        # (cmd, wait_for_response, timeout, future) waiting for the pump task
+        self._commands: asyncio.Queue = asyncio.Queue()
+        self._pump_task: Optional[asyncio.Task] = None
+        # Retries connect() with backoff while the port is down; see _auto_reconnect()
+        self._reconnect_task: Optional[asyncio.Task] = None
+        # Command -> future of its queued exchange, for _COALESCE commands only
+        self._inflight: Dict[bytes, asyncio.Future] = {}
+        # (loop-time expiry, terminator) of replies given up on at an adaptive deadline
+        # that may still arrive; their lines are dropped, not read as the next reply
+        self._owed: deque = deque()
+        # A HOPPER/CHANGE reply is being read, so emergency_stop() may write out of band;
+        # _stop_sent is set when it did, until that exchange has accounted for the output
+        self._payout_active = False
+        self._stop_sent = False
+        # _latency_key() key -> recent complete reply times (seconds per unit of work)
+        self._latency: Dict[bytes, deque] = defaultdict(lambda: deque(maxlen=LATENCY_WINDOW))
+        # (monotonic time, reply) of the last STATUS?; _status_lock makes refreshes single-flight
+        self._status_cache = (0.0, None)
+        self._status_lock = asyncio.Lock()
+        # The port is opened by connect() in the startup event
+    
+    async def connect(self) -> bool:
+        async with self.lock:
+            # _auto_reconnect() may have reconnected while we waited for the lock;
+            # reopening would toggle DTR and reset the board again
+            if self.connected:
+                return True
+            try:
+                # Close if already open
+                if self.writer is not None:
+                    self._close_port()
+                
+                # Create new connection
+                # Fails at once if the port is missing or another process holds it
+                # (see SerialManager._connect_locked)
+                self.reader, self.writer = await serial_asyncio_fast.open_serial_connection(
+                    url=self.port,
+                    baudrate=self.baud,
+                    exclusive=True
+                )
+                _claim_port(self.writer.transport.serial.fileno())
+                # Instead of sleeping a fixed worst case, ping (the leading newline flushes any
+                # partial command in the Arduino's buffer) and return as soon as any line comes
+                # back, with a hard deadline in case the board is still in its bootloader
+                self.writer.write(b"\nSTATUS?\n")
+                await self.writer.drain()
+                try:
+                    await asyncio.wait_for(self.reader.readline(), CONNECT_READY_TIMEOUT)
+                except asyncio.TimeoutError:
+                    pass
+                
+                self._lines = asyncio.Queue()
+                self._rxbuf = bytearray()
+                self._owed.clear()
+                self._read_task = asyncio.create_task(self._read_loop(self.reader, self._rxbuf, self._lines))
+                self.connected = True
+                self.last_error = None
+                # A request got the port back first; the retry loop has nothing left to do
+                task = self._reconnect_task
+                if task is not None and task is not asyncio.current_task():
+                    task.cancel()
+                    self._reconnect_task = None
+                return True
+            
+            except Exception as e:
+                self.last_error = f"Serial connection error: {_describe_open_error(self.port, e)}"
+                print(self.last_error)
+                if self.writer is not None:
+                    # Opened but not usable (e.g. TIOCEXCL refused); don't leak the fd
+                    self._close_port()
+                self.connected = False
+                self._start_auto_reconnect()
+                return False
+    
+    def _start_auto_reconnect(self) -> None:
+        if self._reconnect_task is None or self._reconnect_task.done():
+            self._reconnect_task = asyncio.create_task(self._auto_reconnect())
+    
+    async def _auto_reconnect(self) -> None:
+        """Reconnect in the background, backing off between tries, until the port is back"""
+        for retry_delay in _reconnect_delays():
+            if self.connected:
+                break
+            await asyncio.sleep(retry_delay)
+            print(f"Attempting auto-reconnect to {self.port}...")
+            if await self.connect():
+                print("Auto-reconnect successful!")
+                break
+    
+    async def _read_loop(self, reader: asyncio.StreamReader, rxbuf: bytearray, lines: asyncio.Queue) -> None:
+        """
+        Queue each non-empty line from the device until the port goes away.
+        Takes whatever has arrived in one read and splits lines out of rxbuf;
+        lines stay bytes until a reply is handed back to the caller.
+        """
+        try:
+            while True:
+                chunk = await reader.read(4096)
+                if not chunk:  # EOF: device unplugged or port closed
+                    break
+                rxbuf += chunk
+                while (i := rxbuf.find(b"\n")) != -1:
+                    line = bytes(rxbuf[:i]).strip()
+                    del rxbuf[:i + 1]
+                    if line:
+                        lines.put_nowait(line)
+        except (serial.SerialException, OSError) as e:
+            self.last_error = f"Serial error: {e}"
+            print(self.last_error)
+        finally:
+            # A reconnect (or close()) may already have replaced this reader
+            if self.reader is reader:
+                self.connected = False
+                self._start_auto_reconnect()
+    
+    async def send_command(self, cmd: Union[str, bytes], wait_for_response: bool = True, timeout: float = 2.0) -> Dict[str, Any]:
+        """
+        Send a command to Arduino and optionally wait for response
+        
+        Args:
+            cmd: Command to send; pass prebuilt newline-terminated bytes to skip the encode
+            wait_for_response: Whether to wait for a response
+            timeout: How long to wait for complete response
+            
+        Returns:
+            Dictionary with response lines or error
+        """
+        if isinstance(cmd, str):
+            cmd = _wire(cmd)
+        if wait_for_response and cmd in _COALESCE:
+            # Single-flight: callers asking the same query while it's outstanding share its
+            # reply. Shielded, so one caller going away doesn't cancel it for the others.
+            fut = self._inflight.get(cmd)
+            if fut is None:
+                fut = self._submit(cmd, wait_for_response, timeout)
+                self._inflight[cmd] = fut
+                fut.add_done_callback(lambda _, cmd=cmd: self._inflight.pop(cmd, None))
+            return await asyncio.shield(fut)
+        return await self._submit(cmd, wait_for_response, timeout)
+    
+    def _submit(self, cmd: bytes, wait_for_response: bool, timeout: float) -> asyncio.Future:
+        """Queue a command for the pump task (which owns the port); returns the reply future"""
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.create_task(self._pump())
+        fut = asyncio.get_running_loop().create_future()
+        self._commands.put_nowait((cmd, wait_for_response, timeout, fut))
+        return fut
+    
+    async def emergency_stop(self) -> Dict[str, Any]:
+        """
+        Send STOP. While a HOPPER/CHANGE is paying out it is written now, ahead of the
+        pump queue and without self.lock, so it isn't stuck behind the payout; the
+        device's "OK STOPPED" then ends that reply, which comes back as stopped.
+        writer.write() appends the whole command to the transport in one step on the
+        loop, so it can't split another command's bytes. With nothing to interrupt, it
+        goes through the pump like any command, so its output (the hoppers' stop lines,
+        then "OK STOPPED") is read as its own reply and not as the next command's.
+        """
+        if not self._payout_active:
+            return await self.send_command(CMD_STOP, timeout=STOP_TIMEOUT)
+        if not self.connected or self.writer is None:
+            return {"error": f"Not connected to {self.port}"}
+        try:
+            self.writer.write(CMD_STOP)
+            await self.writer.drain()
+        except (serial.SerialException, ConnectionError) as e:
+            return {"error": f"Serial error: {e}"}
+        self._stop_sent = True
+        return {"success": True}
+    
+    async def _pump(self) -> None:
+        """
+        Run queued commands one exchange at a time. Consecutive single-line reads
+        (see _BATCHABLE) are written back to back and their replies read in order,
+        so a burst of /status and /coins costs one turnaround instead of several.
+        """
+        held = None
+        while True:
+            item = held if held is not None else await self._commands.get()
+            held = None
+            batch = [item]
+            if item[0] in _BATCHABLE:
+                while len(batch) < PUMP_BATCH and not self._commands.empty():
+                    nxt = self._commands.get_nowait()
+                    if nxt[0] not in _BATCHABLE:
+                        # Never batch side effects with reads; it goes next, on its own
+                        held = nxt
+                        break
+                    batch.append(nxt)
+            
+            # Skip commands whose caller has gone away (e.g. client disconnected)
+            batch = [b for b in batch if not b[3].cancelled()]
+            if not batch:
+                continue
+            try:
+                results = await self._exchange(batch)
+            except asyncio.CancelledError:
+                # Shutting down: don't leave these callers waiting forever
+                for _, _, _, fut in batch + ([held] if held is not None else []):
+                    if not fut.done():
+                        fut.set_result({"error": "Connection closed"})
+                raise
+            except Exception as e:
+                results = [{"error": f"Serial error: {e}"}] * len(batch)
+            for (_, _, _, fut), result in zip(batch, results):
+                if not fut.done():
+                    fut.set_result(result)
+    
+    async def _exchange(self, batch: List[tuple]) -> List[Dict[str, Any]]:
+        """Write the batch's commands in one go, then read their replies in submission order"""
+        if not self.connected and not await self.connect():
+            return [{"error": f"Not connected to {self.port}"}] * len(batch)
+        
+        async with self.lock:
+            try:
+                # Clear input buffer (settling any late replies still owed)
+                while not self._lines.empty():
+                    self._consume_owed(self._lines.get_nowait())
+                
+                # Commands with side effects are never batched, so a payout is alone
+                first_cmd, first_wait = batch[0][:2]
+                self._payout_active = first_wait and _latency_key(first_cmd)[0] in _STOPPABLE
+                try:
+                    # Commands are already newline-terminated bytes
+                    self.writer.write(b"".join(cmd for cmd, _, _, _ in batch))
+                    await self.writer.drain()
+                    
+                    results = [await self._read_reply(cmd, wait_for_response, timeout)
+                               for cmd, wait_for_response, timeout, _ in batch]
+                finally:
+                    self._payout_active = False
+                if self._stop_sent:
+                    self._stop_sent = False
+                    if not results[0].get("stopped"):
+                        # The payout ended before the STOP landed: its stop output is
+                        # still coming and belongs to no one, so drop it
+                        self._owed.append((asyncio.get_running_loop().time() + STOP_TIMEOUT,
+                                           terminator_for_bytes(CMD_STOP)))
+                return results
+                
+            except (serial.SerialException, ConnectionError) as e:
+                self.connected = False
+                self._stop_sent = False
+                error_msg = f"Serial error: {e}"
+                print(error_msg)
+                return [{"error": error_msg}] * len(batch)
+    
+    async def _read_reply(self, cmd: bytes, wait_for_response: bool, timeout: float) -> Dict[str, Any]:
+        """Collect the reply lines for one command from the reader task's queue"""
+        if not wait_for_response:
+            return {"success": True}
+        
+        # Read response with timeout; the task sleeps until a line is queued
+        response_lines = []
+        is_last = terminator_for_bytes(cmd)
+        key, units = _latency_key(cmd)
+        loop = asyncio.get_running_loop()
+        start = last_line_at = loop.time()
+        static_end = start + timeout
+        end_time = start + self._reply_timeout(cmd, key, units, timeout)
+        complete = False
+        
+        while True:
+            remaining = end_time - loop.time()
+            # If we have at least one response and no data for a while, consider done
+            if response_lines:
+                remaining -= REPLY_SETTLE
+            line = None
+            if remaining > 0:
+                try:
+                    line = await asyncio.wait_for(self._lines.get(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+            if line is not None:
+                if self._consume_owed(line):
+                    continue  # Late reply to an earlier command, not ours
+                response_lines.append(line)
+                last_line_at = loop.time()
+                if is_last(line):
+                    complete = True
+                    break
+                continue
+            if response_lines and end_time < static_end:
+                # The adaptive deadline passed mid-reply: never cut a reply short, wait
+                # out the caller's timeout (the late sample then widens the estimate)
+                end_time = static_end
+                continue
+            break
+        
+        # Process response
+        if not response_lines:
+            if end_time < static_end:
+                # Silent past the adaptive deadline: fail fast, but count it as a sample
+                # ADAPT_MISS_WIDEN x that deadline so a too-tight estimate recovers
+                self._latency[key].append((end_time - start) * ADAPT_MISS_WIDEN / units)
+                # The reply may still come (until the caller's own timeout); don't let
+                # the next command in this batch, or the next batch, take it as its own
+                self._owed.append((static_end, is_last))
+            return {"error": "No response from device"}
+        
+        # Return all response lines, decoded once for the HTTP layer
+        response = [line.decode('utf-8', 'ignore') for line in response_lines]
+        
+        last = response_lines[-1]
+        if last == LINE_STOPPED and key in _STOPPABLE:
+            # Cut short by an emergency stop: not a success, and not a latency sample
+            return {"error": "Stopped before completion", "stopped": True, "response": response}
+        
+        # Only complete replies are samples; one that timed out has no end time
+        if complete and not last.startswith(b"ERR"):
+            self._latency[key].append((last_line_at - start) / units)
+        
+        return {"response": response}
+    
+    def _consume_owed(self, line: bytes) -> bool:
+        """True if line belongs to a reply given up on earlier (and so should be dropped)"""
+        now = asyncio.get_running_loop().time()
+        while self._owed and self._owed[0][0] < now:
+            self._owed.popleft()  # Past the caller's timeout: it isn't coming
+        if not self._owed:
+            return False
+        if self._owed[0][1](line):
+            self._owed.popleft()
+        return True
+    
+    def _reply_timeout(self, cmd: bytes, key: bytes, units: int, timeout: float) -> float:
+        """The caller's timeout, tightened to what this command has actually needed lately"""
+        samples = self._latency.get(key)
+        if not samples or len(samples) < ADAPT_MIN_SAMPLES:
+            return timeout
+        p99 = sorted(samples)[min(len(samples) - 1, int(len(samples) * 0.99))]
+        adaptive = max(ADAPT_FLOOR, p99 * units * ADAPT_MARGIN)
+        if cmd not in _SINGLE_LINE:
+            # Multi-line replies stop reading REPLY_SETTLE before the deadline
+            adaptive += REPLY_SETTLE
+        return min(timeout, adaptive)
+    
+    async def get_status_cached(self, ttl: float = 2.0) -> Optional[str]:
+        """
+        STATUS? reply, reused for ttl seconds; concurrent callers share one query
+        
+        Returns:
+            The status line, or None if the device didn't answer
+        """
+        ts, status = self._status_cache
+        if status is not None and time.monotonic() - ts < ttl:
+            return status
+        
+        async with self._status_lock:
+            # Whoever held the lock before us may have just refreshed it
+            ts, status = self._status_cache
+            if status is not None and time.monotonic() - ts < ttl:
+                return status
+            
+            result = await self.send_command(CMD_STATUS)
+            if "error" in result or not result.get("response"):
+                return None
+            status = result["response"][0]
+            self._status_cache = (time.monotonic(), status)
+            return status
+    
+    def _close_port(self) -> None:
+        if self._read_task is not None:
+            self._read_task.cancel()
+            self._read_task = None
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+        self.connected = False
+    
+    async def close(self) -> None:
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+            self._reconnect_task = None
+        if self._pump_task is not None:
+            self._pump_task.cancel()
+            self._pump_task = None
+        # Fail anything still queued instead of leaving callers waiting forever
+        while not self._commands.empty():
+            fut = self._commands.get_nowait()[3]
+            if not fut.done():
+                fut.set_result({"error": "Connection closed"})
+        async with self.lock:
+            self._close_port()
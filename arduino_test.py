@@ -1,16 +1,30 @@
 import serial
 import time
 
+# Poll fast right after the count changes (more coins usually follow),
+# then back off while nothing is happening
+MIN_INTERVAL = 0.1
+MAX_INTERVAL = 5.0
+BACKOFF = 1.5
+
 ser = serial.Serial('/dev/ttyACM0', 9600)
 time.sleep(2)
 
 def check_coins():
     ser.write('get\n'.encode())
     res = ser.readline().decode().strip()
-    print(res)
+    return res
 
 if __name__ == '__main__':
+    last_val = None
+    interval = MIN_INTERVAL
     while True:
-        check_coins()
-        time.sleep(2)
-
+        res = check_coins()
+        if res != last_val:
+            # Only print changes
+            print(res)
+            last_val = res
+            interval = MIN_INTERVAL
+        else:
+            interval = min(interval * BACKOFF, MAX_INTERVAL)
+        time.sleep(interval)
@@ -50,7 +50,8 @@ static String readLine() {
   return String();
 }
 
-void start_change(uint16_t amount) {
+// Pay t10 x 10, then t5 x 5, then t1 x 1; ends with "DONE CHANGE <amt>"
+void start_change_plan(uint16_t t10, uint16_t t5, uint16_t t1) {
   
   // Reset all hoppers before starting
   hop10.reset();
@@ -61,10 +62,10 @@ void start_change(uint16_t amount) {
   delay(100);
   
   change.active = true;
-  change.amt = amount;
-  change.t10 = amount / 10; amount -= change.t10 * 10;
-  change.t5  = amount / 5;  amount -= change.t5  * 5;
-  change.t1  = amount;
+  change.amt = t10 * 10 + t5 * 5 + t1;
+  change.t10 = t10;
+  change.t5  = t5;
+  change.t1  = t1;
   change.stage = 10;
 
   // Kick first needed hopper immediately with a short delay before starting
@@ -78,6 +79,35 @@ void start_change(uint16_t amount) {
   }
 }
 
+void start_change(uint16_t amount) {
+  uint16_t t10 = amount / 10; amount -= t10 * 10;
+  uint16_t t5  = amount / 5;  amount -= t5  * 5;
+  start_change_plan(t10, t5, amount);
+}
+
+// Parse "<denom> <n> [<denom> <n> ...]" into per-hopper counts
+static bool parse_hopper_plan(String args, uint16_t& t10, uint16_t& t5, uint16_t& t1) {
+  t10 = t5 = t1 = 0;
+  args.trim();
+  while (args.length()) {
+    int a = args.indexOf(' ');
+    if (a < 0) return false;
+    int denom = args.substring(0, a).toInt();
+    args = args.substring(a + 1);
+    args.trim();
+    int b = args.indexOf(' ');
+    int n = ((b < 0) ? args : args.substring(0, b)).toInt();
+    args = (b < 0) ? String() : args.substring(b + 1);
+    args.trim();
+    if (n <= 0) return false;
+    if      (denom == 10) t10 += n;
+    else if (denom == 5 ) t5  += n;
+    else if (denom == 1 ) t1  += n;
+    else return false;
+  }
+  return true;
+}
+
 void stop_all_change() {
   // Forcibly stop all hoppers
   hop10.stop();
@@ -202,6 +232,13 @@ void loop() {
     if (hop1.busy() || hop5.busy() || hop10.busy() || change.active) { Serial.println("ERR BUSY"); return; }
     int sp2 = rest.indexOf(' ');
     if (sp2 < 0) { Serial.println("ERR BADARG"); return; }
+    if (rest.indexOf(' ', sp2 + 1) >= 0) {
+      // Batched: HOPPER 10 <n> 5 <n> 1 <n> - paid in turn like CHANGE, one round-trip
+      uint16_t t10, t5, t1;
+      if (!parse_hopper_plan(rest, t10, t5, t1)) { Serial.println("ERR BADARG"); return; }
+      start_change_plan(t10, t5, t1);
+      return;
+    }
     int denom = rest.substring(0, sp2).toInt();
     int n     = rest.substring(sp2 + 1).toInt();
     bool ok = false;
@@ -4,6 +4,10 @@
 #include <Arduino.h>
 #include <ArduinoJson.h>
 
+// Every message goes out as a frame: STX, 2-byte little-endian body length, JSON body.
+// The host reads the header and then exactly that many bytes, with no line scanning.
+#define SERIAL_FRAME_STX 0x02
+
 /**
  * SerialMessage - Structure to hold message data for centralized serial communication
  * This is used by modules to pass messages to the main program for serial output
@@ -70,9 +74,12 @@ public:
         }
       }
       
-      // Send the complete message
+      // Send the complete message as one frame
+      size_t len = measureJson(outputDoc);
+      Serial.write((uint8_t)SERIAL_FRAME_STX);
+      Serial.write((uint8_t)(len & 0xFF));
+      Serial.write((uint8_t)(len >> 8));
       serializeJson(outputDoc, Serial);
-      Serial.println();
     }
   }
   